@@ -0,0 +1,136 @@
+import logging
+import threading
+from board_model import Board
+from engine import Engine, THREAT_SCALE, WIN_BOUND
+
+# Hints are redrawn at most this many times per second
+FRAME_RATE = 30
+
+# Part of the heatmap range used by heuristic scores; the rest is for
+# forced wins and losses
+HEAT_RANGE = 0.9
+
+
+def heatmap(board, scores=None, scale=THREAT_SCALE):
+    """
+    Rate empty cells of a board for the player to move, from -1
+    (good for the opponent) to 1 (good for the player). The cell that
+    a column would be played in is rated by the engine score of that
+    column, if known. Other cells are rated by open threats: a cell
+    that completes a line of the player is good, one that completes a
+    line of the opponent is bad. Cells without any of these are left out.
+    :param board: Board
+    :param scores: dict of col -> engine score in this position, or None
+    :param scale: heuristic score that is shaded fully, see {Engine.score_scale}
+    :return: dict of (col, row) -> value, with row 0 at the bottom
+    """
+    player = board.current_player
+    own = board.threats(player)
+    theirs = board.threats(1 - player)
+    scores = scores or {}
+    heights = [board.moves.count(col) for col in range(board.width)]
+
+    values = {}
+    for col in range(board.width):
+        for row in range(heights[col], board.height):
+            value = 0.5 * (((col, row) in own) - ((col, row) in theirs))
+            if value:
+                values[(col, row)] = value
+        if heights[col] < board.height and col in scores:
+            score = scores[col]
+            if score > WIN_BOUND:
+                value = 1
+            elif score < -WIN_BOUND:
+                value = -1
+            else:
+                value = max(-HEAT_RANGE, min(HEAT_RANGE, HEAT_RANGE * score / scale))
+            values[(col, heights[col])] = value
+    return values
+
+
+class Analyser(object):
+    """
+    This class analyses a position on a worker thread while the human
+    thinks. Every completed search depth replaces the latest result,
+    which the GUI picks up at the display frame rate. When a move is
+    made, the analysis is restarted on the new position; the engine
+    and its transposition table are reused, so the new search quickly
+    catches up with the depth reached before.
+    """
+    def __init__(self, engine=None, max_depth=None):
+        self.__engine = engine if engine is not None else Engine()
+        self.__max_depth = max_depth
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+        # Latest result and a counter that changes with every update
+        self.__latest = None
+        self.__generation = 0
+
+    @property
+    def latest(self):
+        """Tuple (generation, moves, SearchResult) of the latest update."""
+        with self.__lock:
+            return self.__latest
+
+    def start(self, board):
+        """
+        (Re)start the analysis of a position. A running analysis is
+        stopped first.
+        :param board: Board to analyse; a copy is searched
+        :return: None
+        """
+        self.stop()
+        moves = board.moves
+        self.__thread = threading.Thread(target=self.__run,
+                                         args=(moves, board.dimensions),
+                                         daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop the analysis and wait for the worker to finish.
+        :return: None
+        """
+        if self.__thread is not None:
+            self.__engine.stop()
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self, moves, dimensions):
+        """
+        Worker thread: deepen the search and publish every result.
+        :param moves: moves of the position to analyse
+        :param dimensions: tuple (width, height, connect) of the board
+        :return: None
+        """
+        board = Board.from_moves(moves, *dimensions)
+        for result in self.__engine.iterate(board, self.__max_depth):
+            with self.__lock:
+                self.__generation += 1
+                self.__latest = (self.__generation, moves, result)
+        logging.debug(f'Analysis of {len(moves)} moves finished')
+
+    def attach(self, widget, callback, fps=FRAME_RATE):
+        """
+        Poll for new results from the Tk event loop of a widget, and
+        call the callback for each new result. The callback is called
+        at most fps times per second, and only when there is something
+        new to show.
+        :param widget: any Tk widget, used for its event loop
+        :param callback: function accepting moves and a SearchResult
+        :param fps: maximum number of updates per second
+        :return: None
+        """
+        delay = max(1, 1000 // fps)
+        shown = None
+
+        def poll():
+            nonlocal shown
+            latest = self.latest
+            if latest is not None and latest[0] != shown:
+                shown = latest[0]
+                callback(latest[1], latest[2])
+            widget.after(delay, poll)
+
+        widget.after(delay, poll)
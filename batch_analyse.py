@@ -0,0 +1,233 @@
+import argparse
+import collections
+import concurrent.futures
+import logging
+import os
+import time
+from board_model import Board
+from engine import THREAT_SCALE, WIN_BOUND, init_worker, worker_engine
+from evaluator import SCORE_SCALE
+from game_record import RecordWriter, read_records, repair
+
+# A move that loses this much against the best move is a blunder
+BLUNDER_MARGIN = 3
+
+# Number of games analysed ahead of the last game written
+WINDOW = 64
+
+# Seconds between progress reports
+PROGRESS_INTERVAL = 5
+
+
+def _analyse(task):
+    """
+    Search one position. Runs in a worker process.
+    :param task: tuple (moves, board dimensions, depth)
+    :return: dict of column -> score
+    """
+    moves, dimensions, depth = task
+    board = Board.from_moves(moves, *dimensions)
+    result = None
+    for result in worker_engine().iterate(board, depth):
+        pass
+    return result.scores
+
+
+def is_blunder(best, played, margin=BLUNDER_MARGIN):
+    """
+    Check whether a move is a blunder: it throws away a win or a draw,
+    or scores much worse than the best move.
+    :param best: score of the best move
+    :param played: score of the move played
+    :param margin: heuristic score difference that counts as a blunder
+    :return: True if the move is a blunder
+    """
+    if best > WIN_BOUND:
+        return played <= WIN_BOUND
+    if best >= -WIN_BOUND:
+        return played < -WIN_BOUND or best - played >= margin
+    return False
+
+
+class BatchAnalyser(object):
+    """
+    This class annotates every move of the games of an archive with
+    an engine score and a blunder flag. Positions are searched in a
+    pool of processes. Positions that occur more than once, in one
+    game or in several, are searched only once: results are cached
+    under the canonical position key. Games are written in input
+    order, and the output can be resumed after an interruption.
+    With evaluator set, positions are scored by an Evaluator; the
+    blunder margin is scaled to its scores.
+    """
+    def __init__(self, depth=8, processes=None, window=WINDOW, cache_size=1000000,
+                 evaluator=False):
+        self.__depth = depth
+        self.__processes = processes
+        self.__evaluator = evaluator
+        self.__margin = BLUNDER_MARGIN * SCORE_SCALE // THREAT_SCALE if evaluator \
+            else BLUNDER_MARGIN
+        self.__window = window
+        self.__cache_size = cache_size
+
+        # Canonical key -> scores (seen from the canonical side) or a future
+        self.__cache = {}
+
+        # Statistics
+        self.games = 0
+        self.positions = 0
+        self.searched = 0
+
+    def run(self, source, target):
+        """
+        Analyse all games of an archive. If the target already holds
+        analysed games, those games are skipped.
+        :param source: archive to read
+        :param target: archive to write the annotated games to
+        :return: number of games analysed
+        """
+        done = repair(target) if os.path.exists(target) else 0
+        if done:
+            logging.info(f'Resuming after {done} games')
+
+        start = time.perf_counter()
+        last_report = start
+        games = collections.deque()
+
+        with concurrent.futures.ProcessPoolExecutor(self.__processes,
+                                                    initializer=init_worker,
+                                                    initargs=(self.__evaluator,)) as pool, \
+                RecordWriter(target) as writer:
+            for number, record in enumerate(read_records(source)):
+                if number < done:
+                    continue
+                if len(self.__cache) > self.__cache_size:
+                    self.__prune(games)
+                games.append((record, self.__submit(pool, record)))
+
+                # Write the games that are done; wait if too far ahead
+                while games and (len(games) >= self.__window or self.__ready(games[0][1])):
+                    self.__write(writer, *games.popleft())
+
+                if time.perf_counter() - last_report > PROGRESS_INTERVAL:
+                    last_report = time.perf_counter()
+                    self.__report(last_report - start)
+
+            while games:
+                self.__write(writer, *games.popleft())
+
+        self.__report(time.perf_counter() - start)
+        return self.games
+
+    def __submit(self, pool, record):
+        """
+        Queue the positions of a game that are not known yet.
+        :param pool: executor to search in
+        :param record: GameRecord
+        :return: list of (cache key, mirrored) of the positions before every move
+        """
+        board = Board(*record.dimensions)
+        positions = []
+        for col in record.moves:
+            # Keys of different board sizes can be equal
+            key, mirrored = board.canonical_key()
+            key = (record.dimensions, key)
+            positions.append((key, mirrored))
+            self.positions += 1
+            if key not in self.__cache:
+                task = (board.moves, record.dimensions, self.__depth)
+                future = pool.submit(_analyse, task)
+                future.mirrored = mirrored
+                self.__cache[key] = future
+                self.searched += 1
+            board.play(col)
+        return positions
+
+    def __prune(self, games):
+        """
+        Empty the cache, except for the positions of queued games.
+        :param games: queued games, as (record, positions)
+        :return: None
+        """
+        keep = {key for _, positions in games for key, _ in positions}
+        self.__cache = {key: self.__cache[key] for key in keep}
+
+    def __ready(self, positions):
+        """
+        Check whether all positions of a game have been searched.
+        :param positions: list of (key, mirrored)
+        :return: True if the game can be written
+        """
+        return all(not isinstance(self.__cache.get(key), concurrent.futures.Future)
+                   or self.__cache[key].done() for key, _ in positions)
+
+    def __scores(self, key, mirrored, width):
+        """
+        Return the scores of a position, waiting for its search if needed.
+        :param key: cache key of the position
+        :param mirrored: True if the position is the mirror image of the key
+        :param width: width of the board
+        :return: dict of column -> score
+        """
+        scores = self.__cache[key]
+        if isinstance(scores, concurrent.futures.Future):
+            # Store the result as seen from the canonical side
+            future = scores
+            scores = future.result()
+            if future.mirrored:
+                scores = {width - 1 - col: s for col, s in scores.items()}
+            self.__cache[key] = scores
+        if mirrored:
+            scores = {width - 1 - col: s for col, s in scores.items()}
+        return scores
+
+    def __write(self, writer, record, positions):
+        """
+        Annotate a game with the scores of its positions and write it.
+        :param writer: RecordWriter of the output archive
+        :param record: GameRecord
+        :param positions: list of (key, mirrored)
+        :return: None
+        """
+        scores = []
+        blunders = []
+        for col, (key, mirrored) in zip(record.moves, positions):
+            position = self.__scores(key, mirrored, record.width)
+            scores.append(position[col])
+            blunders.append(is_blunder(max(position.values()), position[col], self.__margin))
+        record.scores = scores
+        record.blunders = blunders
+        writer.write(record)
+        writer.flush()
+        self.games += 1
+
+    def __report(self, elapsed):
+        """
+        Log progress and throughput.
+        :param elapsed: seconds since the start
+        :return: None
+        """
+        logging.info(f'{self.games} games, {self.positions} positions '
+                     f'({self.positions - self.searched} from cache), '
+                     f'{self.games / max(elapsed, 1e-9):.1f} games/s, '
+                     f'{self.searched / max(elapsed, 1e-9):.1f} searches/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Annotate archived games with engine scores and blunders')
+    parser.add_argument('source', help='archive to analyse')
+    parser.add_argument('target', help='archive to write; resumed if it exists')
+    parser.add_argument('--depth', type=int, default=8, help='search depth')
+    parser.add_argument('--processes', type=int, help='number of worker processes')
+    parser.add_argument('--evaluator', action='store_true',
+                        help='score positions by open threes and twos; finer but slower')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    BatchAnalyser(args.depth, args.processes, evaluator=args.evaluator).run(
+        args.source, args.target)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+from board_model import Board, get_geometry
+from engine import Engine
+from evaluator import Evaluator, ScoredBoard, get_line_tables, score_bitboards
+from perft import perft
+from position_store import PositionStore
+
+logging.basicConfig(level=logging.INFO)
+
+# Positions used to benchmark the engine, as strings of columns played
+BENCHMARK_POSITIONS = {
+    'opening': ('', 8),
+    'early': ('3342', 8),
+    'middle': ('33424225', 8),
+    'tactical': ('3324445521', 9),
+}
+
+# Board sizes to benchmark, as (width, height, connect); boards above
+# 64 bits (9x7) use bitboards wider than a machine word
+BENCHMARK_SIZES = {
+    '7x6': (7, 6, 4),
+    '8x7': (8, 7, 4),
+    '9x7': (9, 7, 4),
+}
+
+
+def write_results(suite, results, path=None):
+    """
+    Write benchmark results as JSON, to a file or to the log.
+    :param suite: name of the benchmark suite
+    :param results: list of dicts with name, value and unit
+    :param path: file to write to, or None to log the results
+    :return: None
+    """
+    report = {
+        'suite': suite,
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if path is None:
+        logging.info(json.dumps(report, indent=2))
+        return
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def bench_search(positions=BENCHMARK_POSITIONS):
+    """
+    Search every benchmark position with and without move ordering.
+    :param positions: dict of name -> (moves, depth)
+    :return: list of results
+    """
+    results = []
+    for name, (moves, depth) in positions.items():
+        for ordering in (False, True):
+            engine = Engine(ordering=ordering)
+            board = Board.from_moves(int(c) for c in moves)
+            label = 'ordered' if ordering else 'unordered'
+
+            nodes = 0
+            start = time.perf_counter()
+            for result in engine.iterate(board, depth):
+                nodes += result.nodes
+            elapsed = time.perf_counter() - start
+
+            results += [
+                {'name': f'search/{name}/{label}/nodes', 'value': nodes, 'unit': 'nodes'},
+                {'name': f'search/{name}/{label}/time', 'value': elapsed, 'unit': 's'},
+                {'name': f'search/{name}/{label}/first-move-cutoffs',
+                 'value': engine.first_move_cutoff_rate, 'unit': 'ratio'},
+            ]
+            logging.info(f'{name} depth {depth} {label}: {nodes} nodes in '
+                         f'{elapsed:.2f}s, {engine.first_move_cutoff_rate:.0%} '
+                         f'of cut-offs on the first move')
+    return results
+
+
+def bench_sizes(sizes=BENCHMARK_SIZES, perft_depth=5, search_depth=7):
+    """
+    Time move generation and search on the empty board of every size.
+    :param sizes: dict of name -> (width, height, connect)
+    :param perft_depth: depth of the move generation count
+    :param search_depth: depth of the search
+    :return: list of results
+    """
+    results = []
+    for name, dimensions in sizes.items():
+        board = Board(*dimensions)
+        start = time.perf_counter()
+        nodes = perft(board, perft_depth)
+        elapsed = time.perf_counter() - start
+        results.append({'name': f'perft/{name}/speed',
+                        'value': nodes / elapsed, 'unit': 'nodes/s'})
+
+        engine = Engine()
+        searched = 0
+        start = time.perf_counter()
+        for result in engine.iterate(board, search_depth):
+            searched += result.nodes
+        elapsed = time.perf_counter() - start
+        results += [
+            {'name': f'search/{name}/nodes', 'value': searched, 'unit': 'nodes'},
+            {'name': f'search/{name}/time', 'value': elapsed, 'unit': 's'},
+        ]
+        logging.info(f'{name}: perft({perft_depth}) {results[-3]["value"]:.0f} nodes/s, '
+                     f'search depth {search_depth} {searched} nodes in {elapsed:.2f}s')
+    return results
+
+
+def bench_store(rows=1000000, lookups=10000):
+    """
+    Time bulk import into a fresh position store and random lookups.
+    :param rows: number of rows to import
+    :param lookups: number of positions to look up
+    :return: list of results
+    """
+    geometry = get_geometry()
+    with tempfile.TemporaryDirectory() as directory:
+        store = PositionStore(os.path.join(directory, 'positions.db'))
+
+        # Spread the keys over the key space, like real positions
+        start = time.perf_counter()
+        store.import_rows(geometry, ((k * 2654435761 % (1 << 48), 0, 10, 3)
+                                     for k in range(rows)))
+        import_time = time.perf_counter() - start
+
+        boards = []
+        for _ in range(lookups):
+            board = Board()
+            for _ in range(random.randint(0, 20)):
+                if board.is_over():
+                    break
+                board.play(random.choice(board.legal_moves()))
+            boards.append(board)
+        start = time.perf_counter()
+        for board in boards:
+            store.get(board)
+        lookup_time = time.perf_counter() - start
+        store.close()
+
+    logging.info(f'store: imported {rows / import_time:.0f} rows/s, '
+                 f'{lookup_time / lookups * 1e6:.1f}us per lookup')
+    return [
+        {'name': 'store/import', 'value': rows / import_time, 'unit': 'rows/s'},
+        {'name': 'store/lookup', 'value': lookup_time / lookups, 'unit': 's'},
+    ]
+
+
+def bench_memory(count=10000, positions=BENCHMARK_POSITIONS):
+    """
+    Measure the memory used per board model in every benchmark position.
+    :param count: number of boards to create per position
+    :param positions: dict of name -> (moves, depth)
+    :return: list of results
+    """
+    results = []
+    for name, (moves, _) in positions.items():
+        moves = [int(c) for c in moves]
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        boards = [Board.from_moves(moves) for _ in range(count)]
+        used = (tracemalloc.get_traced_memory()[0] - before) / count
+        tracemalloc.stop()
+        del boards
+
+        results.append({'name': f'memory/board/{name}', 'value': used, 'unit': 'bytes'})
+        logging.info(f'memory: {used:.0f} bytes per board ({name})')
+    return results
+
+
+def bench_evaluator(games=200, seed=1):
+    """
+    Count evaluations per second over the positions of random games,
+    scored from scratch and looked up in the cache, and the moves per
+    second of replaying the games on a ScoredBoard, evaluating after
+    every move.
+    :param games: number of random games
+    :param seed: seed of the random games
+    :return: list of results
+    """
+    rng = random.Random(seed)
+    boards = []
+    for _ in range(games):
+        board = Board()
+        while not board.is_over():
+            board.play(rng.choice(board.legal_moves()))
+            boards.append(board.copy())
+    tables = get_line_tables(boards[0].geometry)
+    positions = [(b.bitboard(b.current_player), b.bitboard(1 - b.current_player))
+                 for b in boards]
+
+    start = time.perf_counter()
+    for mine, theirs in positions:
+        score_bitboards(tables, mine, theirs)
+    full = len(positions) / (time.perf_counter() - start)
+
+    evaluator = Evaluator(cache_size=len(boards))
+    for board in boards:
+        evaluator.evaluate(board)
+    start = time.perf_counter()
+    for board in boards:
+        evaluator.evaluate(board)
+    cached = len(boards) / (time.perf_counter() - start)
+
+    # Replay the games, evaluating after every move
+    evaluator = Evaluator()
+    count = 0
+    start = time.perf_counter()
+    for board in boards:
+        if board.is_over():
+            scored = ScoredBoard()
+            for col in board.moves:
+                scored.play(col)
+                evaluator.evaluate(scored)
+            count += board.move_count
+    incremental = count / (time.perf_counter() - start)
+
+    logging.info(f'evaluator: {full:.0f} evals/s from scratch, {cached:.0f} evals/s cached, '
+                 f'{incremental:.0f} moves/s played with incremental scores')
+    return [
+        {'name': 'evaluator/full', 'value': full, 'unit': 'evals/s'},
+        {'name': 'evaluator/cached', 'value': cached, 'unit': 'evals/s'},
+        {'name': 'evaluator/incremental-play', 'value': incremental, 'unit': 'moves/s'},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the engine')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    write_results('engine', bench_search() + bench_sizes() + bench_store() + bench_memory() +
+                  bench_evaluator(), args.output)
+
+
+if __name__ == '__main__':
+    main()
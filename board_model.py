@@ -0,0 +1,417 @@
+# Dimensions of the standard Connect4 board
+WIDTH = 7
+HEIGHT = 6
+CONNECT = 4
+
+# Directions in which a line can run: horizontal, vertical and both diagonals
+DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1))
+
+
+class Geometry(object):
+    """
+    Bitboard layout and precomputed line masks for one board size. Each
+    column uses height + 1 bits; the extra bit on top of every column
+    is always empty, so lines can never wrap from one column into the
+    next. Bitboards are Python ints, so any size works; boards of up
+    to 64 bits (e.g. 7x6 and 8x7) also have keys that fit in 64 bits,
+    which the tablebase uses for its file layout.
+    Use {get_geometry} to get the shared instance for a size.
+    """
+    def __init__(self, width, height, connect):
+        if connect > max(width, height):
+            raise ValueError(f'Cannot connect {connect} on a {width}x{height} board')
+        self.width = width
+        self.height = height
+        self.connect = connect
+        self.cells = width * height
+        self.bits = width * (height + 1)
+        self.fits_64 = self.bits <= 64
+
+        # All winning lines of the board (69 on the standard board)
+        self.win_lines = self.__build_win_lines()
+
+        # For every cell bit, the winning lines that pass through that cell
+        self.lines_through = {}
+        for line in self.win_lines:
+            for bit in self.line_bits(line):
+                self.lines_through.setdefault(bit, []).append(line)
+
+        # For every cell bit, the bit of the same cell mirrored in the centre column
+        self.mirror_bit = {self.cell_bit(col, row): self.cell_bit(width - 1 - col, row)
+                           for col in range(width) for row in range(height)}
+
+    def cell_bit(self, col, row):
+        """
+        Return the bitboard bit for a cell.
+        :param col: column of the cell (0 is the left-most column)
+        :param row: row of the cell (0 is the bottom row)
+        :return: integer with only the bit of the cell set
+        """
+        return 1 << (col * (self.height + 1) + row)
+
+    def bit_cell(self, bit):
+        """
+        Return the (col, row) of a single-bit bitboard.
+        :param bit: integer with exactly one bit set
+        :return: tuple (col, row)
+        """
+        return divmod(bit.bit_length() - 1, self.height + 1)
+
+    def mirror_move(self, col):
+        """
+        Return the column mirrored in the centre column.
+        :param col: column
+        :return: mirrored column
+        """
+        return self.width - 1 - col
+
+    @staticmethod
+    def line_bits(line):
+        """
+        Split a mask into its single bits, lowest first.
+        :param line: mask
+        :return: list of single-bit integers
+        """
+        bits = []
+        while line:
+            bit = line & -line
+            bits.append(bit)
+            line ^= bit
+        return bits
+
+    def __build_win_lines(self):
+        """
+        Build the masks of all lines of connect cells on the board.
+        :return: list of integer masks
+        """
+        lines = []
+        for dc, dr in DIRECTIONS:
+            for col in range(self.width):
+                for row in range(self.height):
+                    end_col = col + dc * (self.connect - 1)
+                    end_row = row + dr * (self.connect - 1)
+                    if not (0 <= end_col < self.width and 0 <= end_row < self.height):
+                        continue
+                    mask = 0
+                    for i in range(self.connect):
+                        mask |= self.cell_bit(col + dc * i, row + dr * i)
+                    lines.append(mask)
+        return lines
+
+
+def add_dimension_arguments(parser):
+    """
+    Add the options of the board size to a command line parser:
+    --width, --height and --connect.
+    :param parser: argparse.ArgumentParser
+    :return: None
+    """
+    parser.add_argument('--width', type=int, default=WIDTH, help='number of columns')
+    parser.add_argument('--height', type=int, default=HEIGHT, help='number of rows')
+    parser.add_argument('--connect', type=int, default=CONNECT,
+                        help='number of chips in a row needed to win')
+
+
+_geometries = {}
+
+
+def get_geometry(width=WIDTH, height=HEIGHT, connect=CONNECT):
+    """
+    Return the geometry of a board size. Geometries are built once and
+    shared by all boards of that size.
+    :param width: number of columns
+    :param height: number of rows
+    :param connect: number of chips in a row needed to win
+    :return: Geometry
+    """
+    key = (width, height, connect)
+    geometry = _geometries.get(key)
+    if geometry is None:
+        geometry = _geometries[key] = Geometry(width, height, connect)
+    return geometry
+
+
+class Board(object):
+    """
+    This class holds the state of a Connect4 game, without any GUI.
+    The chips of each player are kept as a bitboard. Every time a chip
+    is played, only the lines through that chip are checked for four
+    in a row. The open threats of both players (empty cells that would
+    complete a line) are kept up to date on every move.
+
+    The board is also kept mirrored in the centre column, so that a
+    position and its mirror image can share one canonical key.
+
+    The board is 7x6 and connects four by default; other sizes are
+    given as width, height and connect.
+    """
+    # Many boards can be in memory at once, e.g. in batch analysis
+    __slots__ = ('__geometry', '__position', '__mask', '__mirror_position',
+                 '__mirror_mask', '__heights', '__moves', '__winning_line', '__threats')
+
+    def __init__(self, width=WIDTH, height=HEIGHT, connect=CONNECT):
+        self.__geometry = get_geometry(width, height, connect)
+
+        # One bitboard per player, plus a mask of all occupied cells
+        self.__position = [0, 0]
+        self.__mask = 0
+
+        # The same, mirrored in the centre column
+        self.__mirror_position = [0, 0]
+        self.__mirror_mask = 0
+
+        # Number of chips in each column
+        self.__heights = bytearray(width)
+
+        # Columns played so far, in order
+        self.__moves = []
+
+        # Winning line (mask) once a player has connected four
+        self.__winning_line = None
+
+        # Per player: threat cell bit -> number of lines it completes
+        self.__threats = [{}, {}]
+
+    @classmethod
+    def from_moves(cls, moves, width=WIDTH, height=HEIGHT, connect=CONNECT):
+        """
+        Create a board by playing a sequence of columns.
+        :param moves: iterable of columns
+        :param width: number of columns
+        :param height: number of rows
+        :param connect: number of chips in a row needed to win
+        :return: new Board
+        """
+        board = cls(width, height, connect)
+        for col in moves:
+            board.play(col)
+        return board
+
+    def copy(self):
+        """
+        Return an independent copy of this board.
+        :return: new Board
+        """
+        return type(self).from_moves(self.__moves, *self.dimensions)
+
+    @property
+    def geometry(self):
+        """Geometry of the board size."""
+        return self.__geometry
+
+    @property
+    def width(self):
+        """Number of columns."""
+        return self.__geometry.width
+
+    @property
+    def height(self):
+        """Number of rows."""
+        return self.__geometry.height
+
+    @property
+    def dimensions(self):
+        """Tuple (width, height, connect)."""
+        geometry = self.__geometry
+        return geometry.width, geometry.height, geometry.connect
+
+    @property
+    def empty_count(self):
+        """Number of empty cells."""
+        return self.__geometry.cells - len(self.__moves)
+
+    @property
+    def moves(self):
+        """Columns played so far, in order."""
+        return tuple(self.__moves)
+
+    @property
+    def move_count(self):
+        """Number of chips on the board."""
+        return len(self.__moves)
+
+    @property
+    def current_player(self):
+        """Player to move: 0 for the first player, 1 for the second."""
+        return len(self.__moves) & 1
+
+    @property
+    def winner(self):
+        """Player that connected four, or None."""
+        if self.__winning_line is None:
+            return None
+        return 1 - self.current_player
+
+    @property
+    def winning_line(self):
+        """Mask of the winning line, or None."""
+        return self.__winning_line
+
+    def is_full(self):
+        """
+        Check whether all cells are occupied.
+        :return: True if no more chips can be played
+        """
+        return len(self.__moves) == self.__geometry.cells
+
+    def is_over(self):
+        """
+        Check whether the game has ended, by a win or a draw.
+        :return: True if the game is over
+        """
+        return self.__winning_line is not None or self.is_full()
+
+    def can_play(self, col):
+        """
+        Check whether a chip can be dropped in a column.
+        :param col: column to check
+        :return: True if the column is not full
+        """
+        return 0 <= col < self.__geometry.width and \
+            self.__heights[col] < self.__geometry.height
+
+    def legal_moves(self):
+        """
+        Return the columns that can be played, left to right.
+        :return: list of columns
+        """
+        if self.__winning_line is not None:
+            return []
+        height = self.__geometry.height
+        return [col for col, h in enumerate(self.__heights) if h < height]
+
+    def play(self, col):
+        """
+        Drop a chip of the current player in a column.
+        :param col: column to play
+        :return: row (0 is the bottom row) where the chip landed
+        """
+        if self.__winning_line is not None:
+            raise ValueError('Game is already won')
+        if not self.can_play(col):
+            raise ValueError(f'Column {col} cannot be played')
+
+        player = self.current_player
+        row = self.__heights[col]
+        bit = self.__geometry.cell_bit(col, row)
+
+        self.__toggle(player, bit)
+        self.__heights[col] += 1
+        self.__moves.append(col)
+
+        # Only the lines through the new chip can have become complete
+        mine = self.__position[player]
+        for line in self.__geometry.lines_through[bit]:
+            if mine & line == line:
+                self.__winning_line = line
+                break
+
+        return row
+
+    def unplay(self):
+        """
+        Take back the last chip played.
+        :return: column of the chip taken back
+        """
+        col = self.__moves.pop()
+        self.__heights[col] -= 1
+        player = self.current_player
+        self.__winning_line = None
+        self.__toggle(player, self.__geometry.cell_bit(col, self.__heights[col]))
+        return col
+
+    def __toggle(self, player, bit):
+        """
+        Add or remove a chip, keeping the threats up to date. The
+        threats of the lines through the cell are removed before the
+        change and added again afterwards.
+        :param player: owner of the chip
+        :param bit: cell bit of the chip
+        :return: None
+        """
+        lines = self.__geometry.lines_through[bit]
+        mirror_bit = self.__geometry.mirror_bit[bit]
+        self.__count_threats(lines, -1)
+        self.__position[player] ^= bit
+        self.__mask ^= bit
+        self.__mirror_position[player] ^= mirror_bit
+        self.__mirror_mask ^= mirror_bit
+        self.__count_threats(lines, 1)
+
+    def __count_threats(self, lines, delta):
+        """
+        Add delta to the threat count of every open threat on the lines.
+        :param lines: line masks to inspect
+        :param delta: 1 to add the threats, -1 to remove them
+        :return: None
+        """
+        mask = self.__mask
+        for player in (0, 1):
+            mine = self.__position[player]
+            counts = self.__threats[player]
+            for line in lines:
+                # A threat is a line missing exactly one chip, on an empty cell
+                empty = line & ~mine
+                if not empty or empty & (empty - 1) or empty & mask:
+                    continue
+                count = counts.get(empty, 0) + delta
+                if count:
+                    counts[empty] = count
+                else:
+                    del counts[empty]
+
+    def key(self):
+        """
+        Return an integer that uniquely identifies the position: the
+        chips of the player to move plus the mask of occupied cells.
+        :return: position key
+        """
+        return self.__position[self.current_player] + self.__mask
+
+    def canonical_key(self):
+        """
+        Return the key shared by the position and its mirror image: the
+        smaller of the two keys. Moves stored under a mirrored key must
+        be mirrored back with {Geometry.mirror_move}.
+        :return: tuple (key, mirrored), mirrored is True if the key is
+                 that of the mirror image
+        """
+        player = self.current_player
+        key = self.__position[player] + self.__mask
+        mirror_key = self.__mirror_position[player] + self.__mirror_mask
+        if mirror_key < key:
+            return mirror_key, True
+        return key, False
+
+    def bitboard(self, player):
+        """
+        Return the chips of a player as a bitboard; see {Geometry}.
+        :param player: 0 or 1
+        :return: integer with the cell bits of the chips set
+        """
+        return self.__position[player]
+
+    def threat_count(self, player):
+        """
+        Return the number of open threats of a player.
+        :param player: 0 or 1
+        :return: number of threat cells
+        """
+        return len(self.__threats[player])
+
+    def threats(self, player):
+        """
+        Return the open threats of a player: empty cells that would
+        connect four for that player.
+        :param player: 0 or 1
+        :return: set of (col, row) tuples
+        """
+        return {self.__geometry.bit_cell(bit) for bit in self.__threats[player]}
+
+    def line_cells(self, line):
+        """
+        Return the cells of a line mask, e.g. the winning line.
+        :param line: line mask
+        :return: list of (col, row) tuples
+        """
+        return [self.__geometry.bit_cell(bit) for bit in Geometry.line_bits(line)]
@@ -17,6 +17,10 @@ INSTALLATION: Put this file where Python can see it.
 
 """
 
+import asyncio
+import collections
+import functools
+import sys
 import tkinter
 import tkinter.simpledialog
 
@@ -35,6 +39,15 @@ HORIZONTAL = tkinter.HORIZONTAL
 RAISED = tkinter.RAISED
 SINGLE = tkinter.SINGLE
 ACTIVE = tkinter.ACTIVE
+HIDDEN = tkinter.HIDDEN
+
+# Delays in milliseconds of the poller that runs posted callables.
+# The delay doubles while nothing is posted, up to the maximum.
+POST_MIN_DELAY = 10
+POST_MAX_DELAY = 160
+
+# Times per second that runAsync handles Tk events
+ASYNC_FRAME_RATE = 60
 
 class EasyFrame(tkinter.Frame):
     """Represents an application window."""
@@ -55,6 +68,12 @@ class EasyFrame(tkinter.Frame):
         # Set the background color and resizability
         self.setBackground(background)
         self.setResizable(resizable)
+        # Callables posted by other threads, and the poller that runs them
+        self._posted = collections.deque()
+        self._postDelay = POST_MIN_DELAY
+        self.after(self._postDelay, self._runPosted)
+        # The asyncio event loop, while runAsync runs
+        self._loop = None
 
     def setBackground(self, color):
         """Resets the window's background color to color."""
@@ -73,6 +92,89 @@ class EasyFrame(tkinter.Frame):
         """Resets the window's title to title."""
         self.master.title(title)
 
+    # Methods to update the window from other threads.  Tk may only
+    # be used from the thread that runs mainloop, so other threads
+    # post callables, which that thread then runs.
+
+    def post(self, function, *args):
+        """Runs function with the given arguments on the thread
+        of the window, soon.  Can be called from any thread."""
+        if args:
+            function = functools.partial(function, *args)
+        self.postBatch((function,))
+
+    def postBatch(self, functions):
+        """Runs a sequence of functions without arguments on the
+        thread of the window, in order and all in the same update.
+        Can be called from any thread."""
+        functions = tuple(functions)
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._runBatch, functions)
+        else:
+            self._posted.append(functions)
+
+    def _runBatch(self, functions):
+        """Runs posted functions, reporting errors the way Tk
+        reports errors in its own callbacks."""
+        for function in functions:
+            try:
+                function()
+            except Exception:
+                self.master.report_callback_exception(*sys.exc_info())
+
+    def _runQueued(self):
+        """Runs everything posted so far and returns the number
+        of batches run."""
+        count = len(self._posted)
+        for _ in range(count):
+            self._runBatch(self._posted.popleft())
+        return count
+
+    def _runPosted(self):
+        """Runs everything posted so far, then polls again: soon
+        if something was posted, later and later if not."""
+        if self._runQueued():
+            self._postDelay = POST_MIN_DELAY
+        else:
+            self._postDelay = min(2 * self._postDelay, POST_MAX_DELAY)
+        self.after(self._postDelay, self._runPosted)
+
+    # Methods to run the window together with an asyncio event loop,
+    # instead of with mainloop.
+
+    def runAsync(self, coroutine = None, frameRate = ASYNC_FRAME_RATE):
+        """Runs the window and an asyncio event loop together on
+        this thread, until the window is closed.  Tk events are
+        handled frameRate times per second; in between, the event
+        loop runs tasks and callbacks, which may update the window
+        directly.  If a coroutine is given, it is run as a task,
+        which is cancelled when the window closes."""
+        asyncio.run(self._runAsync(coroutine, frameRate))
+
+    async def _runAsync(self, coroutine, frameRate):
+        """Handles Tk events once per frame and sleeps in between."""
+        # What was posted before the loop ran goes first
+        loop = asyncio.get_running_loop()
+        loop.call_soon(self._runQueued)
+        self._loop = loop
+        task = None
+        if coroutine is not None:
+            task = asyncio.ensure_future(coroutine)
+        interval = 1 / frameRate
+        try:
+            while True:
+                start = self._loop.time()
+                self.update()
+                await asyncio.sleep(max(0, interval - (self._loop.time() - start)))
+        except tkinter.TclError:
+            # The window has been closed
+            pass
+        finally:
+            self._loop = None
+            if task is not None:
+                task.cancel()
+
     # Methods to add widgets to the window.  The row and column in
     # the grid are required arguments.
 
@@ -552,6 +654,13 @@ class EasyCanvas(tkinter.Canvas):
         self.bind("<ButtonPress-1>", self.mousePressed)
         self.bind("<ButtonRelease-1>", self.mouseReleased)
         self.bind("<B1-Motion>", self.mouseDragged)
+        # Released items by kind, the same as a set, the kind of
+        # every pooled item, and pool statistics
+        self._pool = {}
+        self._poolFree = set()
+        self._poolKinds = {}
+        self._poolCreated = 0
+        self._poolReused = 0
 
     # Mouse event handling methods.  One or more of these methods can 
     # be overridden in the subclass to implement the required actions.
@@ -628,8 +737,57 @@ class EasyCanvas(tkinter.Canvas):
     def deleteItem(self, item):
         """Removes and erases the shape with the given item
         number from the canvas."""
+        kind = self._poolKinds.pop(item, None)
+        if item in self._poolFree:
+            self._poolFree.discard(item)
+            self._pool[kind].remove(item)
         self.delete(item)
 
+    # Methods to reuse items.  Items that come and go, such as
+    # overlays, can be released to a pool instead of deleted, and
+    # acquired again later with new coordinates and options.  The
+    # number of items on the canvas then stops growing.
+
+    def acquireItem(self, kind, *coords, **options):
+        """Returns an item of the given kind ("line", "oval",
+        "rectangle", "text" or "image") at the given coordinates,
+        with the given options, on top of the other items.  A
+        released item of that kind is reused if there is one;
+        options that are not given keep their earlier values."""
+        free = self._pool.get(kind)
+        if free:
+            item = free.pop()
+            self._poolFree.discard(item)
+            self.coords(item, *coords)
+            self.itemconfig(item, state = NORMAL, **options)
+            self.tag_raise(item)
+            self._poolReused += 1
+        else:
+            item = getattr(self, "create_" + kind)(*coords, **options)
+            self._poolKinds[item] = kind
+            self._poolCreated += 1
+        return item
+
+    def releaseItem(self, item):
+        """Hides an item that was returned by acquireItem,
+        and keeps it for reuse.  Releasing an item again
+        does nothing."""
+        if item in self._poolFree:
+            return
+        self._poolFree.add(item)
+        self.itemconfig(item, state = HIDDEN)
+        self._pool.setdefault(self._poolKinds[item], []).append(item)
+
+    def poolStats(self):
+        """Returns a dictionary with the number of pooled items
+        created, the number of times an item was reused, and the
+        number of pooled items in use and free."""
+        free = len(self._poolFree)
+        return {"created": self._poolCreated,
+                "reused": self._poolReused,
+                "inUse": len(self._poolKinds) - free,
+                "free": free}
+
 # Support classes for dialogs.
 
 class MessageBox(tkinter.simpledialog.Dialog):
@@ -0,0 +1,415 @@
+import logging
+import threading
+from evaluator import SCORE_SCALE, Evaluator
+from tablebase import DRAW, LOSS, WIN
+
+# Score of a win on the very first move. Wins that take longer score less,
+# so the engine prefers quick wins and slow losses.
+WIN_SCORE = 1000
+
+# Any score beyond this bound is a forced win or loss. Boards have far
+# fewer cells than this, and heuristic scores stay well below it.
+WIN_BOUND = WIN_SCORE // 2
+
+# Heuristic score of a clearly better position with the default
+# evaluation, which counts open threats
+THREAT_SCALE = 4
+
+# Flags of transposition table entries
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when the engine is asked to stop."""
+
+
+class SearchResult(object):
+    """
+    Result of a search to a fixed depth: the score of every legal
+    column (from the point of view of the player to move), the best
+    column and the principal variation.
+    """
+    __slots__ = ('depth', 'scores', 'pv', 'nodes')
+
+    def __init__(self, depth, scores, pv, nodes):
+        self.depth = depth
+        self.scores = scores
+        self.pv = pv
+        self.nodes = nodes
+
+    @property
+    def best_move(self):
+        """Best column, or None if there are no legal moves."""
+        return self.pv[0] if self.pv else None
+
+    @property
+    def score(self):
+        """Score of the best column."""
+        return self.scores[self.best_move] if self.pv else 0
+
+
+def format_score(score, move_count):
+    """
+    Format a score for display. Forced wins and losses are shown as
+    the number of plies until the end of the game.
+    :param score: score from the point of view of the player to move
+    :param move_count: number of chips on the board
+    :return: short string
+    """
+    if score > WIN_BOUND:
+        return f'W{WIN_SCORE - score - move_count}'
+    if score < -WIN_BOUND:
+        return f'L{WIN_SCORE + score - move_count}'
+    return f'{score:+d}'
+
+
+class Engine(object):
+    """
+    This class searches Connect4 positions with an alpha-beta search and
+    iterative deepening. The transposition table is kept between
+    searches, so searching a position again after a move is cheap.
+    Positions are stored under their canonical key, so a position and
+    its mirror image share one entry; best moves are stored as seen
+    from the canonical side.
+    The search can be stopped from another thread with {stop}.
+
+    Moves are tried in this order: the best move from the table, the
+    killer moves of the ply, then by history score and centre first.
+    With ordering disabled, columns are tried left to right.
+
+    With a Tablebase, late-game positions are looked up instead of
+    searched. The tablebase does not know how long a win takes, so
+    those wins score as the slowest possible win.
+
+    With a PositionStore, positions searched to at least store_depth
+    are looked up in the store first, and exact results of at least
+    that depth are written back to it.
+
+    Positions at the search horizon are scored by the difference in
+    open threats, which the board keeps up to date. With an Evaluator,
+    they are scored by open threes and twos instead; this is finer but
+    slower, so it is only used when given.
+    """
+    def __init__(self, max_table_size=1000000, ordering=True, tablebase=None,
+                 store=None, store_depth=10, evaluator=None):
+        self.__table = {}
+        self.__evaluator = evaluator
+        self.__tablebase = tablebase
+        self.__store = store
+        self.__store_depth = store_depth
+        self.__max_table_size = max_table_size
+        self.__stop = threading.Event()
+        self.ordering = ordering
+
+        # Board size the tables below are made for
+        self.__geometry = None
+
+        # Two killer moves per ply, a history score per player and column,
+        # and the rank of every column in the static order: centre first
+        self.__killers = []
+        self.__history = [[], []]
+        self.__centre_rank = []
+
+        # Counters of the last search
+        self.nodes = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    @property
+    def first_move_cutoff_rate(self):
+        """Fraction of the cut-offs of the last search on the first move."""
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    @property
+    def score_scale(self):
+        """Heuristic score of a clearly better position, e.g. to shade hints by."""
+        return THREAT_SCALE if self.__evaluator is None else SCORE_SCALE
+
+    def stop(self):
+        """
+        Ask a running search to stop as soon as possible.
+        :return: None
+        """
+        self.__stop.set()
+
+    @property
+    def stopped(self):
+        """True if the last search was stopped before it finished."""
+        return self.__stop.is_set()
+
+    def clear(self):
+        """
+        Empty the transposition table.
+        :return: None
+        """
+        self.__table.clear()
+
+    def iterate(self, board, max_depth=None):
+        """
+        Search a position to increasing depths. A result is yielded for
+        every completed depth. The board is restored afterwards, also
+        when the search is stopped.
+        :param board: Board to search
+        :param max_depth: deepest depth to search, default to the end of the game
+        :return: generator of SearchResult
+        """
+        self.__stop.clear()
+        self.__prepare(board)
+        for history in self.__history:
+            history[:] = [score // 2 for score in history]
+
+        empty = board.empty_count
+        max_depth = empty if max_depth is None else min(max_depth, empty)
+        for depth in range(1, max_depth + 1):
+            try:
+                result = self.search(board, depth)
+            except SearchAborted:
+                logging.debug(f'Search stopped at depth {depth}')
+                return
+            yield result
+
+            # Stop deepening once every column is decided
+            if all(abs(s) > WIN_BOUND for s in result.scores.values()):
+                return
+
+    def best_move(self, board, depth):
+        """
+        Search a position and return the best column.
+        :param board: Board to search
+        :param depth: depth to search
+        :return: column, or None if the game is over
+        """
+        result = None
+        for result in self.iterate(board, depth):
+            pass
+        return result.best_move if result is not None else None
+
+    def search(self, board, depth):
+        """
+        Search a position to a fixed depth. Every root column is
+        searched with a full window, so all column scores are exact.
+        :param board: Board to search
+        :param depth: depth to search, in plies
+        :return: SearchResult
+        """
+        self.__prepare(board)
+        self.nodes = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        if len(self.__table) > self.__max_table_size:
+            self.__table.clear()
+
+        scores = {}
+        for col in self.__order_moves(board, None):
+            scores[col] = self.__score_move(board, col, depth, -WIN_SCORE, WIN_SCORE)
+
+        pv = []
+        if scores:
+            best = max(scores, key=lambda c: (scores[c], -self.__centre_rank[c]))
+            pv = self.__principal_variation(board, best)
+            if self.__store is not None and depth >= self.__store_depth:
+                self.__store.put(board, scores[best], depth, best)
+        return SearchResult(depth, scores, pv, self.nodes)
+
+    def __prepare(self, board):
+        """
+        Set up the tables for the size of a board. Switching to another
+        board size empties the transposition table.
+        :param board: Board about to be searched
+        :return: None
+        """
+        geometry = board.geometry
+        if geometry is self.__geometry:
+            return
+        self.__geometry = geometry
+        self.__table.clear()
+        self.__killers = [[None, None] for _ in range(geometry.cells + 1)]
+        self.__history = [[0] * geometry.width, [0] * geometry.width]
+        self.__centre_rank = [abs(2 * col - geometry.width + 1)
+                              for col in range(geometry.width)]
+
+    def __score_move(self, board, col, depth, alpha, beta):
+        """
+        Play a column, score the resulting position and take it back.
+        :return: score from the point of view of the player playing col
+        """
+        board.play(col)
+        try:
+            if board.winner is not None:
+                return WIN_SCORE - board.move_count
+            return -self.__negamax(board, depth - 1, -beta, -alpha)
+        finally:
+            board.unplay()
+
+    def __negamax(self, board, depth, alpha, beta):
+        """
+        Alpha-beta search of the position from the point of view of the
+        player to move.
+        :return: score of the position
+        """
+        self.nodes += 1
+        if not self.nodes & 1023 and self.__stop.is_set():
+            raise SearchAborted()
+
+        if board.is_full():
+            return 0
+
+        if self.__tablebase is not None:
+            result = self.__tablebase.probe(board)
+            if result == WIN:
+                return WIN_SCORE - board.geometry.cells
+            if result == LOSS:
+                return board.geometry.cells - WIN_SCORE
+            if result == DRAW:
+                return 0
+
+        if depth == 0:
+            return self.evaluate(board)
+
+        key, mirrored = board.canonical_key()
+        entry = self.__table.get(key)
+        table_move = None
+        if entry is not None:
+            table_depth, flag, score, table_move = entry
+            if table_depth >= depth:
+                if flag == EXACT:
+                    return score
+                if flag == LOWER and score >= beta:
+                    return score
+                if flag == UPPER and score <= alpha:
+                    return score
+            if mirrored and table_move is not None:
+                table_move = board.geometry.mirror_move(table_move)
+
+        if self.__store is not None and depth >= self.__store_depth:
+            stored = self.__store.get(board)
+            if stored is not None and stored[1] >= depth:
+                return stored[0]
+
+        original_alpha = alpha
+        best_score = -WIN_SCORE
+        best_move = None
+        for i, col in enumerate(self.__order_moves(board, table_move)):
+            score = self.__score_move(board, col, depth, alpha, beta)
+            if score > best_score:
+                best_score = score
+                best_move = col
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                self.cutoffs += 1
+                if i == 0:
+                    self.first_move_cutoffs += 1
+                self.__store_cutoff(board, col, depth)
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if self.__store is not None and flag == EXACT and depth >= self.__store_depth:
+            self.__store.put(board, best_score, depth, best_move)
+
+        if mirrored:
+            best_move = board.geometry.mirror_move(best_move)
+        self.__table[key] = (depth, flag, best_score, best_move)
+        return best_score
+
+    def __order_moves(self, board, table_move):
+        """
+        Return the legal moves in the order in which to search them.
+        :param board: Board to move in
+        :param table_move: best move from the transposition table, or None
+        :return: list of columns
+        """
+        moves = board.legal_moves()
+        if not self.ordering:
+            return moves
+
+        killers = self.__killers[board.move_count]
+        history = self.__history[board.current_player]
+        centre_rank = self.__centre_rank
+
+        def rank(col):
+            if col == table_move:
+                return 0, 0, 0
+            if col in killers:
+                return 1, killers.index(col), 0
+            return 2, -history[col], centre_rank[col]
+
+        return sorted(moves, key=rank)
+
+    def __store_cutoff(self, board, col, depth):
+        """
+        Remember a move that caused a cut-off, as killer move of the ply
+        and in the history table.
+        :param board: Board in which the move was played
+        :param col: column that caused the cut-off
+        :param depth: remaining depth at which it happened
+        :return: None
+        """
+        if not self.ordering:
+            return
+        killers = self.__killers[board.move_count]
+        if killers[0] != col:
+            killers[1] = killers[0]
+            killers[0] = col
+        self.__history[board.current_player][col] += depth * depth
+
+    def __principal_variation(self, board, first):
+        """
+        Follow the best moves stored in the transposition table.
+        :param board: Board at the root
+        :param first: best column at the root
+        :return: list of columns
+        """
+        pv = [first]
+        board.play(first)
+        while board.winner is None and not board.is_full():
+            key, mirrored = board.canonical_key()
+            entry = self.__table.get(key)
+            if entry is None or entry[3] is None or len(pv) >= board.geometry.cells:
+                break
+            col = board.geometry.mirror_move(entry[3]) if mirrored else entry[3]
+            pv.append(col)
+            board.play(col)
+        for _ in pv:
+            board.unplay()
+        return pv
+
+    def evaluate(self, board):
+        """
+        Static evaluation at the search horizon: the difference in the
+        number of open threats, or the score of the evaluator if given.
+        :param board: Board to evaluate
+        :return: score from the point of view of the player to move
+        """
+        if self.__evaluator is not None:
+            return self.__evaluator.evaluate(board)
+        player = board.current_player
+        return board.threat_count(player) - board.threat_count(1 - player)
+
+
+# Engine of a worker process, kept between searches; see {init_worker}
+_worker_engine = None
+
+
+def init_worker(evaluator=False):
+    """
+    Create the engine of a worker process. Use as the initializer of a
+    process pool whose tasks search with {worker_engine}.
+    :param evaluator: score positions with an Evaluator
+    :return: None
+    """
+    global _worker_engine
+    _worker_engine = Engine(evaluator=Evaluator() if evaluator else None)
+
+
+def worker_engine():
+    """
+    Return the engine of the current worker process.
+    :return: Engine
+    """
+    return _worker_engine
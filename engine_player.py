@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import threading
+import time
+from board_model import Board
+from engine import Engine
+
+
+class EnginePlayer(object):
+    """
+    This class lets the engine play one side of the game. The search
+    runs on a worker thread, so the GUI stays responsive.
+
+    While the human thinks, the engine ponders: it plays the reply it
+    predicts from its principal variation and searches the resulting
+    position. If the human plays the predicted move, that search is
+    already running (or done) and the engine can reply right away. The
+    transposition table is kept between moves either way.
+    """
+    def __init__(self, depth=8, ponder=True, engine=None):
+        self.__engine = engine if engine is not None else Engine()
+        self.__depth = depth
+        self.__ponder = ponder
+        self.__lock = threading.Lock()
+
+        # Current search job: moves of its position, thread and result
+        self.__job_moves = None
+        self.__thread = None
+        self.__result = None
+
+        # Position the GUI is waiting for, and when it started waiting
+        self.__wanted = None
+        self.__requested_at = 0
+
+        # Called on the worker thread when a search is done
+        self.__on_reply = None
+
+        # Statistics
+        self.requests = 0
+        self.ponder_hits = 0
+        self.total_response_time = 0.0
+
+    @property
+    def mean_response_time(self):
+        """Average time in seconds between a request and the reply."""
+        return self.total_response_time / self.requests if self.requests else 0.0
+
+    def set_reply_handler(self, handler):
+        """
+        Set a function without arguments that is called when a search
+        is done. It is called on the worker thread, so it should only
+        hand over to the GUI thread, e.g. with {EasyFrame.post}; the
+        GUI then calls {poll}.
+        :param handler: Function to call
+        :return: None
+        """
+        self.__on_reply = handler
+
+    def request(self, board):
+        """
+        Ask for a move in a position. If the engine was pondering this
+        position, the running search is kept.
+        :param board: Board in which the engine is to move
+        :return: None
+        """
+        moves = board.moves
+        self.__wanted = moves
+        self.__requested_at = time.perf_counter()
+        self.requests += 1
+        if moves == self.__job_moves:
+            self.ponder_hits += 1
+            logging.info('Ponder hit')
+        else:
+            self.__start(moves, board.dimensions)
+
+    def poll(self):
+        """
+        Return the move for the requested position once it is known.
+        :return: column, or None while the engine is still thinking
+        """
+        with self.__lock:
+            result = self.__result
+        if self.__wanted is None or result is None or result[0] != self.__wanted:
+            return None
+
+        self.__wanted = None
+        self.total_response_time += time.perf_counter() - self.__requested_at
+        return result[1].best_move
+
+    def ponder(self, board):
+        """
+        Start searching the position after the predicted reply of the
+        human, using the principal variation of the last search.
+        :param board: Board after the engine's own move
+        :return: None
+        """
+        with self.__lock:
+            result = self.__result
+        if not self.__ponder or result is None or board.is_over():
+            return
+
+        # The principal variation started with the move just played
+        pv = result[1].pv
+        if len(pv) < 2 or result[0] + (pv[0],) != board.moves:
+            return
+        logging.debug(f'Pondering on column {pv[1]}')
+        self.__start(board.moves + (pv[1],), board.dimensions)
+
+    def stop(self):
+        """
+        Stop the running search, if any.
+        :return: None
+        """
+        if self.__thread is not None:
+            self.__engine.stop()
+            self.__thread.join()
+            self.__thread = None
+            self.__job_moves = None
+
+    def __start(self, moves, dimensions):
+        """
+        Replace the running search with a search of another position.
+        :param moves: moves of the position to search
+        :param dimensions: tuple (width, height, connect) of the board
+        :return: None
+        """
+        self.stop()
+        self.__job_moves = moves
+        self.__thread = threading.Thread(target=self.__run,
+                                         args=(moves, dimensions),
+                                         daemon=True)
+        self.__thread.start()
+
+    def __run(self, moves, dimensions):
+        """
+        Worker thread: search a position to the full depth.
+        :param moves: moves of the position to search
+        :param dimensions: tuple (width, height, connect) of the board
+        :return: None
+        """
+        board = Board.from_moves(moves, *dimensions)
+        result = None
+        for result in self.__engine.iterate(board, self.__depth):
+            pass
+        if result is None or self.__engine.stopped:
+            return
+        with self.__lock:
+            self.__result = (moves, result)
+        if self.__on_reply is not None:
+            self.__on_reply()
+
+
+async def next_move(player, board):
+    """
+    Ask a player for a move and wait for it, without blocking the
+    asyncio event loop. Works with any player that has {request},
+    {poll} and {set_reply_handler}; the reply handler is replaced.
+    :param player: EnginePlayer or RemotePlayer
+    :param board: Board in which the player is to move
+    :return: column
+    """
+    loop = asyncio.get_running_loop()
+    replied = asyncio.Event()
+    player.set_reply_handler(lambda: loop.call_soon_threadsafe(replied.set))
+    player.request(board)
+    while True:
+        # The reply may be a pondered search that was already done
+        col = player.poll()
+        if col is not None:
+            return col
+        await replied.wait()
+        replied.clear()
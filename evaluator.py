@@ -0,0 +1,219 @@
+from board_model import Board, DIRECTIONS, WIDTH, HEIGHT, CONNECT
+
+# Score of a line that holds chips of only one player, by the number of
+# chips it still misses: one (an open three) or two (an open two)
+THREE_WEIGHT = 4
+TWO_WEIGHT = 1
+
+# Heuristic scores are kept within this bound, well below WIN_BOUND
+MAX_SCORE = 250
+
+# Score of a clearly better position; most positions score well below it
+SCORE_SCALE = MAX_SCORE // 10
+
+# Positions kept in the evaluation cache before it is emptied
+CACHE_SIZE = 1 << 16
+
+
+class LineTables(object):
+    """
+    Precomputed masks for evaluating positions of one board size with
+    bit operations. For every direction, the window of connect cells
+    starting at a cell is found by shifting a bitboard by the shifts of
+    the direction; starts is the mask of the cells at which a whole
+    window fits on the board.
+    Use {get_line_tables} to get the shared instance for a size.
+    """
+    __slots__ = ('geometry', 'windows', 'weights')
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        height = geometry.height
+
+        # (shifts, starts) per direction
+        self.windows = []
+        for dc, dr in DIRECTIONS:
+            starts = 0
+            for col in range(geometry.width):
+                for row in range(height):
+                    end_col = col + dc * (geometry.connect - 1)
+                    end_row = row + dr * (geometry.connect - 1)
+                    if 0 <= end_col < geometry.width and 0 <= end_row < height:
+                        starts |= geometry.cell_bit(col, row)
+            if starts:
+                shift = dc * (height + 1) + dr
+                self.windows.append((tuple(i * shift for i in range(geometry.connect)),
+                                     starts))
+
+        # Score of a line by the number of chips of its only owner
+        self.weights = [0] * (geometry.connect + 1)
+        for missing, weight in ((2, TWO_WEIGHT), (1, THREE_WEIGHT)):
+            if geometry.connect - missing > 0:
+                self.weights[geometry.connect - missing] = weight
+
+
+_tables = {}
+
+
+def get_line_tables(geometry):
+    """
+    Return the line tables of a board size, built once per size.
+    :param geometry: Geometry of the board size
+    :return: LineTables
+    """
+    tables = _tables.get(geometry)
+    if tables is None:
+        tables = _tables[geometry] = LineTables(geometry)
+    return tables
+
+
+def score_bitboards(tables, mine, theirs):
+    """
+    Score a position given as two bitboards: the weighted number of
+    open threes and twos of one player minus those of the other. All
+    windows of one direction are counted at once, by shifting the
+    bitboards over the window: at_least[k] collects the windows with
+    more than k chips.
+    :param tables: LineTables of the board size
+    :param mine: bitboard of the player to score for
+    :param theirs: bitboard of the opponent
+    :return: score from the point of view of mine
+    """
+    weights = tables.weights
+    score = 0
+    for shifts, starts in tables.windows:
+        mine_at_least = [0] * len(shifts)
+        theirs_at_least = [0] * len(shifts)
+        for i, shift in enumerate(shifts):
+            m = mine >> shift
+            t = theirs >> shift
+            for k in range(i, 0, -1):
+                mine_at_least[k] |= mine_at_least[k - 1] & m
+                theirs_at_least[k] |= theirs_at_least[k - 1] & t
+            mine_at_least[0] |= m
+            theirs_at_least[0] |= t
+
+        # Open windows of a player hold none of the opponent's chips
+        mine_open = starts & ~theirs_at_least[0]
+        theirs_open = starts & ~mine_at_least[0]
+        for k in range(1, len(shifts)):
+            weight = weights[k]
+            if weight:
+                mine_exact = mine_at_least[k - 1] & ~mine_at_least[k] & mine_open
+                theirs_exact = theirs_at_least[k - 1] & ~theirs_at_least[k] & theirs_open
+                score += weight * (mine_exact.bit_count() - theirs_exact.bit_count())
+    return score
+
+
+def _line_score(line, first, second, weights):
+    """
+    Score of one line from the point of view of the first player.
+    :return: weight of the line for its only owner, negative for the second player
+    """
+    if not line & second:
+        return weights[(line & first).bit_count()]
+    if not line & first:
+        return -weights[(line & second).bit_count()]
+    return 0
+
+
+class ScoredBoard(Board):
+    """
+    A Board that keeps its evaluation up to date on every move, so
+    that evaluating it costs nothing. Playing a chip only changes the
+    score of the lines through that chip; taking it back restores the
+    score from a stack. Use it instead of a Board where many positions
+    are evaluated, e.g. in a search.
+    """
+    __slots__ = ('__tables', '__scores')
+
+    def __init__(self, width=WIDTH, height=HEIGHT, connect=CONNECT):
+        Board.__init__(self, width, height, connect)
+        self.__tables = get_line_tables(self.geometry)
+
+        # Score after every move, from the point of view of the first player
+        self.__scores = [0]
+
+    @property
+    def score(self):
+        """Score of the position from the point of view of the first player."""
+        return self.__scores[-1]
+
+    def play(self, col):
+        row = Board.play(self, col)
+        bit = self.geometry.cell_bit(col, row)
+        first, second = self.bitboard(0), self.bitboard(1)
+        before_first, before_second = first, second
+        if self.current_player:
+            before_first ^= bit
+        else:
+            before_second ^= bit
+
+        weights = self.__tables.weights
+        delta = 0
+        for line in self.geometry.lines_through[bit]:
+            delta += _line_score(line, first, second, weights) - \
+                _line_score(line, before_first, before_second, weights)
+        self.__scores.append(self.__scores[-1] + delta)
+        return row
+
+    def unplay(self):
+        self.__scores.pop()
+        return Board.unplay(self)
+
+
+class Evaluator(object):
+    """
+    This class scores positions by the open threes and twos of both
+    players; see {score_bitboards}. Scores of positions are cached
+    under their canonical key, so a position and its mirror image are
+    scored once. A ScoredBoard is not scored again: its incremental
+    score is used as is.
+    """
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.__cache = {}
+        self.__cache_size = cache_size
+        self.__geometry = None
+        self.__tables = None
+
+        # Statistics
+        self.evaluations = 0
+        self.cache_hits = 0
+
+    def evaluate(self, board):
+        """
+        Score a position.
+        :param board: Board or ScoredBoard to evaluate
+        :return: score from the point of view of the player to move
+        """
+        player = board.current_player
+        if isinstance(board, ScoredBoard):
+            score = board.score if player == 0 else -board.score
+            return max(-MAX_SCORE, min(MAX_SCORE, score))
+
+        if board.geometry is not self.__geometry:
+            self.__geometry = board.geometry
+            self.__tables = get_line_tables(board.geometry)
+            self.__cache.clear()
+
+        key, _ = board.canonical_key()
+        score = self.__cache.get(key)
+        if score is not None:
+            self.cache_hits += 1
+            return score
+
+        self.evaluations += 1
+        score = score_bitboards(self.__tables, board.bitboard(player),
+                                board.bitboard(1 - player))
+        score = max(-MAX_SCORE, min(MAX_SCORE, score))
+        if len(self.__cache) >= self.__cache_size:
+            self.__cache.clear()
+        self.__cache[key] = score
+        return score
+
+    def clear(self):
+        """
+        Empty the cache.
+        :return: None
+        """
+        self.__cache.clear()
@@ -1,44 +1,251 @@
+import argparse
+import asyncio
+import functools
 import logging
+import time
+from array import array
+from analysis import Analyser, heatmap
+from board_model import Board, HEIGHT, WIDTH, add_dimension_arguments
 from breezypythongui import EasyCanvas, EasyFrame
+from engine import Engine, format_score
+from engine_player import EnginePlayer, next_move
+from evaluator import Evaluator
+from game_record import GameRecord, RecordWriter
+from journal import Journal, restore
+from position_store import PositionStore
+from remote_player import RemotePlayer
 
 logging.basicConfig(level=logging.INFO)
 
+# Size of a cell in pixels, unless another size is given
+CELL_SIZE = 100
+
+# Seconds in which further clicks on the same column are ignored
+CLICK_DEBOUNCE = 0.25
+
+# Milliseconds per frame; at most one click is handled per frame
+INPUT_FRAME = 1000 // 60
+
+# Colours of the heatmap, from bad to good for the side to move
+HEAT_COLOURS = ['#d73027', '#f46d43', '#fdae61', '#fee08b',
+                '#d9ef8b', '#a6d96a', '#66bd63', '#1a9850']
+
+# Milliseconds between heatmap updates at most
+HEATMAP_INTERVAL = 200
+
+
+class _Layout(object):
+    """
+    This class holds the canvas coordinates of everything on a board of
+    a given size. Boards of the same size share one layout; see {_layout}.
+    All sizes scale with the cell size.
+    """
+    def __init__(self, columns, rows, cell_size):
+        diam = cell_size
+        margin = diam / 5
+
+        # Per cell: bounding boxes of the shadow, the chip, the threat
+        # marker and the heatmap shading, and the centre
+        self.shadows = {}
+        self.circles = {}
+        self.markers = {}
+        self.centres = {}
+        self.heat = {}
+        for col in range(columns):
+            for row in range(rows):
+                x = margin + col * diam
+                y = margin + row * diam
+                cx, cy = x + 0.45 * diam, y + 0.45 * diam
+                self.shadows[(col, row)] = (x + 0.02 * diam, y, x + 0.92 * diam, y + 0.92 * diam)
+                self.circles[(col, row)] = (x, y, x + 0.9 * diam, y + 0.9 * diam)
+                self.markers[(col, row)] = (cx - 0.12 * diam, cy - 0.12 * diam,
+                                            cx + 0.12 * diam, cy + 0.12 * diam)
+                self.centres[(col, row)] = (cx, cy)
+                self.heat[(col, row)] = (cx - 0.3 * diam, cy - 0.3 * diam,
+                                         cx + 0.3 * diam, cy + 0.3 * diam)
+
+        self.marker_width = max(1, round(0.03 * diam))
+        self.line_width = max(2, round(0.12 * diam))
+        self.hint_y = margin + rows * diam + 0.1 * diam
+        self.status_x = margin
+        self.status_y = margin + rows * diam + 0.4 * diam
+        self.hint_font = ('Helvetica', max(6, round(0.16 * diam)))
+        self.status_font = ('Helvetica', max(6, round(0.14 * diam)))
+
+        self.__columns = columns
+        self.__rows = rows
+        self.__margin = margin
+        self.__diam = diam
+
+    def cell_at(self, x, y):
+        """
+        Return the cell at canvas coordinates, clamped to the board.
+        :param x: x coordinate
+        :param y: y coordinate
+        :return: tuple (col, row)
+        """
+        col = int((x - self.__margin) // self.__diam)
+        row = int((y - self.__margin) // self.__diam)
+        return (min(max(col, 0), self.__columns - 1),
+                min(max(row, 0), self.__rows - 1))
+
+
+@functools.lru_cache(maxsize=None)
+def _layout(columns, rows, cell_size):
+    """
+    Return the shared layout of a board size.
+    :return: _Layout
+    """
+    return _Layout(columns, rows, cell_size)
+
+
+def board_size(columns, rows, cell_size=CELL_SIZE, extra=0):
+    """
+    Return the canvas size that fits a board.
+    :param columns: number of columns
+    :param rows: number of rows
+    :param cell_size: size of a cell in pixels
+    :param extra: extra height, in cells, e.g. for hints and status
+    :return: tuple (width, height)
+    """
+    return (round((columns + 0.3) * cell_size),
+            round((rows + 0.3 + extra) * cell_size))
+
+
+def chip_cells(moves, columns, rows):
+    """
+    Work out where the chips of a game land.
+    :param moves: columns played, in order
+    :param columns: number of columns
+    :param rows: number of rows
+    :return: list of (col, row) of every chip, in order, with row 0 at the top
+    """
+    heights = [0] * columns
+    cells = []
+    for col in moves:
+        cells.append((col, rows - 1 - heights[col]))
+        heights[col] += 1
+    return cells
+
 
 class GameBoard(EasyCanvas):
     """
     This class creates a GameBoard for the Connect4 game. It creates
-    7 columns of each 6 cells. Each cell can be set to any colour
+    7 columns of each 6 cells, unless other numbers of columns and
+    rows are given. Each cell can be set to any colour
     using the method {update_cell}. If a cell is clicked, the click
     handler is called (if it is set).
+
+    Clicks go through an input queue. Repeated clicks on a column within
+    the debounce time are ignored, and so are clicks while the board is
+    busy (see {set_busy}). At most one click is passed to the click
+    handler per frame; other clicks in that frame are dropped.
+
+    Winning lines and threats are drawn as overlays. Threat markers
+    are created once and are then only shown or hidden; other overlay
+    items come from the item pool of the canvas and go back to it when
+    hidden, so the number of items does not grow as games go on.
+
+    The cells are cell_size pixels; everything else scales with them.
     """
-    def __init__(self, parent, width, height):
+    def __init__(self, parent, width, height, columns=WIDTH, rows=HEIGHT,
+                 cell_size=CELL_SIZE, debounce=CLICK_DEBOUNCE):
         EasyCanvas.__init__(self, parent, width=width, height=height, background='blue')
+        self.__columns = columns
+        self.__rows = rows
+        self.__layout = layout = _layout(columns, rows, cell_size)
 
         # Placeholder for click handler
-        self.__on_click = None
+        self.__click_handler = None
+
+        # Input queue: time of the last click per column, the click
+        # waiting for the next frame, and whether input is ignored
+        self.__debounce = debounce
+        self.__last_clicks = [float('-inf')] * columns
+        self.__queued_click = None
+        self.__busy = False
+
+        # Item ids of all cells, at index col * rows + row
+        self.__cells = array('l', [0]) * (columns * rows)
+
+        # Threat markers, one per cell, and the colour each one shows
+        self.__markers = array('l', [0]) * (columns * rows)
+        self.__shown_threats = {}
+
+        # Heatmap shading while shown: (col, row) -> (item, bucket)
+        self.__heat = {}
+
+        # Winning line overlay while shown, and its cells
+        self.__line = None
+        self.__shown_line = None
 
-        # This 2D list will hold all cells
-        self.__cells = [list([None] * 6) for _ in range(7)]
+        # Hint texts below the columns and the status line below them
+        self.__hints = []
+        self.__status = None
 
-        diam = 100
-        for col in range(7):
-            for row in range(6):
+        for col in range(columns):
+            for row in range(rows):
                 fill = '#707080'
-                x = 20 + col * diam
-                y = 20 + row * diam
 
                 # Give the impression of depth
-                self.drawOval(x+2, y, x+diam-8, y+diam-8,
+                self.drawOval(*layout.shadows[(col, row)],
                               outline='black', fill='black')
 
                 # This circle may become a coloured chip
-                circle = self.drawOval(x, y, x+diam-10, y+diam-10,
+                circle = self.drawOval(*layout.circles[(col, row)],
                                        outline='black', fill=fill)
-                self.tag_bind(f'circle-{col}-{row}', '<ButtonRelease-1>',
-                              lambda _, c=col, r=row: self.__on_click(c, r))
-                self.itemconfig(circle, tags=f'circle-{col}-{row}')
+                self.itemconfig(circle, tags='cell')
+
+                self.__cells[col * rows + row] = circle
+
+        # Markers go on top of all cells. They share the tag of the
+        # cells so that clicking a marker still clicks the cell.
+        for col in range(columns):
+            for row in range(rows):
+                marker = self.drawOval(*layout.markers[(col, row)],
+                                       outline='white', fill='')
+                self.itemconfig(marker, state='hidden', width=layout.marker_width,
+                                tags=('cell', 'marker'))
+                self.__markers[col * rows + row] = marker
+
+        # One binding for all cells; the cell is found from the position
+        self.tag_bind('cell', '<ButtonRelease-1>', self.__cell_released)
+
+        for col in range(columns):
+            cx, _ = layout.centres[(col, 0)]
+            self.__hints.append(self.drawText('', cx, layout.hint_y,
+                                              fill='white', font=layout.hint_font))
+        self.__status = self.drawText('', layout.status_x, layout.status_y, fill='white',
+                                      font=layout.status_font, anchor='w')
+
+    def __cell_released(self, event):
+        """
+        A cell was clicked. Works out which one, and queues the click
+        unless it is ignored.
+        :param event: Tk event
+        :return: None
+        """
+        col, row = self.__layout.cell_at(self.canvasx(event.x), self.canvasy(event.y))
+        now = time.monotonic()
+        if now - self.__last_clicks[col] < self.__debounce:
+            logging.debug(f'Ignoring repeated click on column {col}')
+            return
+        self.__last_clicks[col] = now
+        if self.__busy or self.__queued_click is not None:
+            logging.debug(f'Ignoring click on column {col}')
+            return
 
-                self.__cells[col][row] = circle
+        self.__queued_click = (col, row)
+        self.after(INPUT_FRAME, self.__deliver_click)
+
+    def __deliver_click(self):
+        """
+        Pass the queued click on, unless the board became busy meanwhile.
+        :return: None
+        """
+        click, self.__queued_click = self.__queued_click, None
+        if click is not None and not self.__busy:
+            self.__on_click(*click)
 
     def __on_click(self, col, row):
         """
@@ -49,8 +256,8 @@ class GameBoard(EasyCanvas):
         """
         logging.info(f'Click event at col={col},row={row}')
 
-        if self.__on_click is not None:
-            self.__on_click(col, row)
+        if self.__click_handler is not None:
+            self.__click_handler(col, row)
 
     def set_click_handler(self, handler):
         """
@@ -59,7 +266,15 @@ class GameBoard(EasyCanvas):
         :param handler: Function that handles click events
         :return: None
         """
-        self.__on_click = handler
+        self.__click_handler = handler
+
+    def set_busy(self, busy):
+        """
+        Ignore clicks while busy, e.g. while the other player thinks.
+        :param busy: True to ignore clicks
+        :return: None
+        """
+        self.__busy = busy
 
     def update_cell(self, col, row, colour):
         """
@@ -69,25 +284,357 @@ class GameBoard(EasyCanvas):
         :param colour: colour to set in selected cell
         :return: None
         """
-        cell = self.__cells[col][row]
+        cell = self.__cells[col * self.__rows + row]
         self.itemconfig(cell, fill=colour)
 
+        # Shading lies on top of the chip; remove it now rather than at
+        # the next heatmap update
+        heat = self.__heat.pop((col, row), None)
+        if heat is not None:
+            self.releaseItem(heat[0])
+
+    def show_line(self, cells):
+        """
+        Highlight a line of cells, e.g. the winning line. Only one line
+        is shown at a time.
+        :param cells: list of (col, row) of the cells on the line
+        :return: None
+        """
+        key = tuple(sorted(cells))
+        if key == self.__shown_line:
+            return
+        self.hide_line()
+
+        x0, y0 = self.__layout.centres[key[0]]
+        x1, y1 = self.__layout.centres[key[-1]]
+        self.__line = self.acquireItem('line', x0, y0, x1, y1, fill='white',
+                                       width=self.__layout.line_width, capstyle='round')
+        self.__shown_line = key
+
+    def hide_line(self):
+        """
+        Hide the highlighted line, if any.
+        :return: None
+        """
+        if self.__shown_line is not None:
+            self.releaseItem(self.__line)
+            self.__line = None
+            self.__shown_line = None
+
+    def show_hints(self, hints, best=None):
+        """
+        Show a short text below every column, e.g. the engine score.
+        The best column is shown in a different colour.
+        :param hints: dict of col -> text; missing columns are cleared
+        :param best: column to highlight, or None
+        :return: None
+        """
+        for col, item in enumerate(self.__hints):
+            self.itemconfig(item, text=hints.get(col, ''),
+                            fill='yellow' if col == best else 'white')
+
+    def set_status(self, text):
+        """
+        Show a line of text below the board.
+        :param text: text to show
+        :return: None
+        """
+        self.itemconfig(self.__status, text=text)
+
+    def show_heatmap(self, values):
+        """
+        Shade cells by value, e.g. how good they are for the side to
+        move. Values are put into one bucket per heatmap colour, and
+        only cells whose bucket changes are redrawn. The shading items
+        come from the item pool and go back to it when not needed.
+        :param values: dict of (col, row) -> value from -1 (bad) to 1
+            (good); cells that are not in it are not shaded
+        :return: None
+        """
+        for cell in [c for c in self.__heat if c not in values]:
+            self.releaseItem(self.__heat.pop(cell)[0])
+
+        buckets = len(HEAT_COLOURS)
+        for cell, value in values.items():
+            bucket = min(buckets - 1, max(0, int((value + 1) / 2 * buckets)))
+            shown = self.__heat.get(cell)
+            if shown is None:
+                item = self.acquireItem('oval', *self.__layout.heat[cell],
+                                        fill=HEAT_COLOURS[bucket], outline='', tags='cell')
+
+                # Keep the threat markers visible on top
+                self.tag_lower(item, 'marker')
+                self.__heat[cell] = (item, bucket)
+            elif shown[1] != bucket:
+                self.itemconfig(shown[0], fill=HEAT_COLOURS[bucket])
+                self.__heat[cell] = (shown[0], bucket)
+
+    def hide_heatmap(self):
+        """
+        Remove all heatmap shading.
+        :return: None
+        """
+        self.show_heatmap({})
+
+    def set_threats(self, threats):
+        """
+        Show threat markers. Only markers that change are touched.
+        :param threats: dict of (col, row) -> colour of the marker
+        :return: None
+        """
+        for (col, row) in list(self.__shown_threats):
+            if (col, row) not in threats:
+                self.itemconfig(self.__markers[col * self.__rows + row], state='hidden')
+                del self.__shown_threats[(col, row)]
+
+        for (col, row), colour in threats.items():
+            if self.__shown_threats.get((col, row)) != colour:
+                self.itemconfig(self.__markers[col * self.__rows + row],
+                                outline=colour, state='normal')
+                self.__shown_threats[(col, row)] = colour
+
 
 def main():
+    parser = argparse.ArgumentParser(description='Connect4')
+    parser.add_argument('--hint', action='store_true',
+                        help='analyse the position while the human thinks')
+    parser.add_argument('--engine', action='store_true',
+                        help='let the engine play yellow')
+    parser.add_argument('--depth', type=int, default=8,
+                        help='search depth of the engine')
+    parser.add_argument('--no-ponder', action='store_true',
+                        help='do not search while the human thinks')
+    add_dimension_arguments(parser)
+    parser.add_argument('--archive', help='append the finished game to this file')
+    parser.add_argument('--store', help='keep analysis results in this database')
+    parser.add_argument('--server', metavar='HOST:PORT',
+                        help='let the engine of a game server play yellow')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='run the window from an asyncio event loop')
+    parser.add_argument('--journal', help='save the game in progress to this file, '
+                                          'and continue the game saved in it')
+    parser.add_argument('--heatmap', action='store_true',
+                        help='shade cells by how good they are; press h to toggle')
+    parser.add_argument('--evaluator', action='store_true',
+                        help='score positions by open threes and twos; finer but slower')
+    args = parser.parse_args()
+
     colours = ['red', 'yellow']
-    current = 0
+    board = Board(args.width, args.height, args.connect)
+    journal = None
+    if args.journal:
+        # Continue an unfinished game; the model is rebuilt without drawing
+        saved = restore(args.journal)
+        if saved is not None:
+            dimensions, moves = saved
+            try:
+                restored = Board.from_moves(moves, *dimensions)
+            except ValueError as e:
+                logging.warning(f'Cannot continue the game from {args.journal}: {e}')
+                restored = None
+            if restored is not None and not restored.is_over():
+                board = restored
+                logging.info(f'Continuing the game from {args.journal} '
+                             f'after {board.move_count} moves')
+        journal = Journal(args.journal)
+        journal.start(board.dimensions, board.moves)
+    rows = board.height
 
     f = EasyFrame()
-    game = GameBoard(f, 730, 630)
+    game = GameBoard(f, *board_size(board.width, rows,
+                                    extra=0.7 if args.hint or args.server else 0),
+                     columns=board.width, rows=rows)
     f.addCanvas(game)
 
-    def handler(col, row):
-        nonlocal current
-        game.update_cell(col, row, colours[current])
-        current = 1 - current
+    store = PositionStore(args.store) if args.store else None
+    # The engines search on different threads, so each has its own evaluator
+    hint_engine = Engine(store=store, evaluator=Evaluator() if args.evaluator else None)
+    analyser = Analyser(hint_engine) if args.hint else None
+    # The engine player never searches deeper than --depth, so use the
+    # store for the positions near the root of its searches
+    opponent = EnginePlayer(args.depth, not args.no_ponder,
+                            Engine(store=store, store_depth=max(1, args.depth - 2),
+                                   evaluator=Evaluator() if args.evaluator else None)) \
+        if args.engine else None
+    if args.server:
+        host, _, port = args.server.rpartition(':')
+        opponent = RemotePlayer(host or '127.0.0.1', int(port), args.depth,
+                                board.dimensions)
+
+    # Heatmap: whether it is shown, the latest engine scores as
+    # (moves, scores), and whether an update is scheduled
+    heatmap_on = args.heatmap
+    heatmap_scores = (None, None)
+    heatmap_scheduled = False
+
+    def refresh_heatmap():
+        # Update the heatmap soon; does nothing while it is off
+        nonlocal heatmap_scheduled
+        if heatmap_on and not heatmap_scheduled:
+            heatmap_scheduled = True
+            game.after(HEATMAP_INTERVAL, draw_heatmap)
+
+    def draw_heatmap():
+        nonlocal heatmap_scheduled
+        heatmap_scheduled = False
+        if not heatmap_on:
+            return
+        if board.is_over():
+            game.hide_heatmap()
+            return
+        moves, scores = heatmap_scores
+        values = heatmap(board, scores if moves == board.moves else None,
+                         hint_engine.score_scale)
+        game.show_heatmap({(c, rows - 1 - r): v for (c, r), v in values.items()})
+
+    def toggle_heatmap(_):
+        nonlocal heatmap_on
+        heatmap_on = not heatmap_on
+        if heatmap_on:
+            refresh_heatmap()
+        else:
+            game.hide_heatmap()
+
+    f.master.bind('<KeyPress-h>', toggle_heatmap)
+
+    def show_analysis(moves, result):
+        nonlocal heatmap_scores
+        # Ignore results of a position that is no longer on the board
+        if moves != board.moves:
+            return
+        heatmap_scores = (moves, result.scores)
+        refresh_heatmap()
+        game.show_hints({col: format_score(score, len(moves))
+                         for col, score in result.scores.items()},
+                        result.best_move)
+        game.set_status(f'depth {result.depth}, '
+                        f'best line {len(result.pv)} plies, {result.nodes} nodes')
+
+    if analyser is not None:
+        analyser.attach(game, show_analysis)
+        analyser.start(board)
+
+    def show_overlays():
+        if board.winning_line is not None:
+            game.show_line([(c, rows - 1 - r)
+                            for c, r in board.line_cells(board.winning_line)])
+
+        threats = {}
+        for p in (0, 1):
+            for c, r in board.threats(p):
+                threats[(c, rows - 1 - r)] = colours[p]
+        game.set_threats(threats)
+
+    def show_position():
+        # Draw every chip once, e.g. after restoring a game
+        for ply, cell in enumerate(chip_cells(board.moves, board.width, rows)):
+            game.update_cell(*cell, colours[ply & 1])
+        show_overlays()
+
+    def play(col):
+        player = board.current_player
+        row = board.play(col)
+        if journal is not None:
+            journal.record(col)
+
+        # The model counts rows from the bottom, the board from the top
+        game.update_cell(col, rows - 1 - row, colours[player])
+        if board.winning_line is not None:
+            logging.info(f'Player {player} won')
+        show_overlays()
+        refresh_heatmap()
+
+        if analyser is not None:
+            game.show_hints({})
+            game.set_status('')
+            if board.is_over() or board.current_player == 1 and opponent is not None:
+                analyser.stop()
+            else:
+                analyser.start(board)
+
+        if board.is_over() and args.archive:
+            with RecordWriter(args.archive) as writer:
+                writer.write(GameRecord.from_board(board))
+
+        if board.is_over() and opponent is not None:
+            opponent.stop()
+            logging.info(f'Engine replied in {opponent.mean_response_time:.3f}s on '
+                         f'average, {opponent.ponder_hits} of {opponent.requests} '
+                         f'moves were pondered')
+
+    def engine_played(col):
+        game.set_busy(False)
+        play(col)
+        opponent.ponder(board)
+
+        if isinstance(opponent, RemotePlayer) and opponent.last_round_trip is not None:
+            game.set_status(f'Server {opponent.status}, round trip '
+                            f'{opponent.last_round_trip * 1000:.1f} ms, reply in '
+                            f'{opponent.mean_response_time * 1000:.0f} ms on average')
+
+    def engine_moved():
+        # Runs on the GUI thread, posted by the opponent's reply handler
+        col = opponent.poll()
+        if col is not None:
+            engine_played(col)
+
+    async def engine_turn():
+        # Runs as a task of the event loop that drives the window
+        engine_played(await next_move(opponent, board))
+
+    if opponent is not None and not args.asyncio:
+        opponent.set_reply_handler(lambda: f.post(engine_moved))
+
+    # Running engine turns; the event loop only keeps weak references
+    turns = set()
+
+    def request_engine_move():
+        game.set_busy(True)
+        if isinstance(opponent, RemotePlayer):
+            game.set_status(f'Server {opponent.status}, waiting for a move')
+        if args.asyncio:
+            turn = asyncio.ensure_future(engine_turn())
+            turns.add(turn)
+            turn.add_done_callback(turns.discard)
+        else:
+            opponent.request(board)
+
+            # A pondered search may already be done
+            engine_moved()
+
+    def handler(col, _):
+        if board.is_over() or not board.can_play(col):
+            return
+        if opponent is not None and board.current_player == 1:
+            return
+        play(col)
+
+        if opponent is not None and not board.is_over():
+            request_engine_move()
+
+    def sync_journal():
+        # The last moves reach the disk even if nobody moves for a while
+        journal.sync()
+        f.after(int(journal.sync_interval * 1000), sync_journal)
 
     game.set_click_handler(handler)
-    f.mainloop()
+    if journal is not None:
+        sync_journal()
+    if board.move_count:
+        show_position()
+    refresh_heatmap()
+    if opponent is not None and board.current_player == 1:
+        # A restored game may be waiting for the engine
+        f.post(request_engine_move)
+    if args.asyncio:
+        f.runAsync()
+    else:
+        f.mainloop()
+
+    if store is not None:
+        store.close()
+    if journal is not None:
+        journal.close()
 
 
 if __name__ == '__main__':
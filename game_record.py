@@ -0,0 +1,361 @@
+import logging
+import mmap
+import os
+import struct
+from board_model import WIDTH, HEIGHT, CONNECT
+
+# Results of a game
+UNFINISHED, FIRST_WINS, SECOND_WINS, DRAW = 0, 1, 2, 3
+
+# Record layout: header, moves as one column nibble each (two per byte,
+# first move in the low nibble), then optionally one score per move and
+# a bitmap with one blunder flag per move.
+MAGIC = b'C4'
+HEADER = struct.Struct('<2sBBBBBH')
+SCORE = struct.Struct('<h')
+
+# Header flags
+HAS_SCORES = 1
+HAS_BLUNDERS = 2
+
+# The sidecar index of an archive holds the offset of every record
+INDEX_SUFFIX = '.idx'
+OFFSET = struct.Struct('<Q')
+
+
+class GameRecord(object):
+    """
+    A played game: the board size, the columns played, the result and
+    optionally the engine score of every move and whether it was a
+    blunder.
+    """
+    __slots__ = ('moves', 'result', 'scores', 'blunders', 'width', 'height', 'connect')
+
+    def __init__(self, moves, result=UNFINISHED, scores=None,
+                 width=WIDTH, height=HEIGHT, connect=CONNECT, blunders=None):
+        self.moves = list(moves)
+        self.result = result
+        self.scores = scores
+        self.blunders = blunders
+        self.width = width
+        self.height = height
+        self.connect = connect
+
+    @classmethod
+    def from_board(cls, board, scores=None):
+        """
+        Create a record of the game on a board.
+        :param board: Board with the moves played
+        :param scores: list of scores, one per move, or None
+        :return: GameRecord
+        """
+        if board.winner is not None:
+            result = FIRST_WINS if board.winner == 0 else SECOND_WINS
+        elif board.is_full():
+            result = DRAW
+        else:
+            result = UNFINISHED
+        return cls(board.moves, result, scores, *board.dimensions)
+
+    @property
+    def dimensions(self):
+        """Tuple (width, height, connect)."""
+        return self.width, self.height, self.connect
+
+
+def encode(record):
+    """
+    Encode a game record.
+    :param record: GameRecord
+    :return: bytes
+    """
+    if record.width > 16:
+        raise ValueError('Columns are stored in 4 bits, boards can be 16 wide at most')
+    moves = record.moves
+    if record.scores is not None and len(record.scores) != len(moves):
+        raise ValueError('Need exactly one score per move')
+    if record.blunders is not None and len(record.blunders) != len(moves):
+        raise ValueError('Need exactly one blunder flag per move')
+
+    flags = 0
+    if record.scores is not None:
+        flags |= HAS_SCORES
+    if record.blunders is not None:
+        flags |= HAS_BLUNDERS
+    data = bytearray(HEADER.pack(MAGIC, flags, record.width, record.height,
+                                 record.connect, record.result, len(moves)))
+    for i in range(0, len(moves), 2):
+        high = moves[i + 1] if i + 1 < len(moves) else 0
+        data.append(moves[i] | high << 4)
+    if record.scores is not None:
+        for score in record.scores:
+            data += SCORE.pack(score)
+    if record.blunders is not None:
+        bitmap = bytearray((len(moves) + 7) // 8)
+        for i, blunder in enumerate(record.blunders):
+            if blunder:
+                bitmap[i >> 3] |= 1 << (i & 7)
+        data += bitmap
+    return bytes(data)
+
+
+def record_size(move_count, flags):
+    """
+    Return the number of bytes of an encoded record.
+    :param move_count: number of moves
+    :param flags: header flags of the record
+    :return: number of bytes
+    """
+    size = HEADER.size + (move_count + 1) // 2
+    if flags & HAS_SCORES:
+        size += move_count * SCORE.size
+    if flags & HAS_BLUNDERS:
+        size += (move_count + 7) // 8
+    return size
+
+
+def read_record(f):
+    """
+    Read the next record from a binary file.
+    :param f: file opened for reading in binary mode
+    :return: GameRecord, or None at the end of the file
+    """
+    header = f.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise EOFError('Truncated game record')
+    magic, flags, width, height, connect, result, count = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError('Not a game record')
+
+    body_size = record_size(count, flags) - HEADER.size
+    body = f.read(body_size)
+    if len(body) < body_size:
+        raise EOFError('Truncated game record')
+
+    moves = []
+    for byte in body[:(count + 1) // 2]:
+        moves.append(byte & 15)
+        moves.append(byte >> 4)
+    del moves[count:]
+
+    offset = (count + 1) // 2
+    scores = None
+    if flags & HAS_SCORES:
+        scores = [s for (s,) in SCORE.iter_unpack(body[offset:offset + count * SCORE.size])]
+        offset += count * SCORE.size
+    blunders = None
+    if flags & HAS_BLUNDERS:
+        blunders = [bool(body[offset + (i >> 3)] >> (i & 7) & 1) for i in range(count)]
+    return GameRecord(moves, result, scores, width, height, connect, blunders)
+
+
+def read_records(path):
+    """
+    Read all records of an archive, one at a time. Only one game is in
+    memory at a time, so archives of any size can be processed.
+    :param path: archive file
+    :return: generator of GameRecord
+    """
+    with open(path, 'rb') as f:
+        while True:
+            record = read_record(f)
+            if record is None:
+                return
+            yield record
+
+
+def build_index(path):
+    """
+    Write the sidecar index of an archive. Only the record headers are
+    read; the bodies are skipped. A partly written record at the end
+    is left out.
+    :param path: archive file
+    :return: number of records
+    """
+    count = 0
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f, open(path + INDEX_SUFFIX, 'wb') as index:
+        while True:
+            offset = f.tell()
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            magic, flags, _, _, _, _, moves = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f'No game record at offset {offset}')
+            if offset + record_size(moves, flags) > size:
+                # A record that was only partly written
+                break
+            index.write(OFFSET.pack(offset))
+            f.seek(record_size(moves, flags) - HEADER.size, os.SEEK_CUR)
+            count += 1
+    return count
+
+
+def index_is_current(path, partial=False):
+    """
+    Check that the sidecar index of an archive matches the archive: the
+    last record it points to ends at the end of the archive. The two are
+    written separately, so after a crash the index can lag behind the
+    archive or point past its end.
+    :param path: archive file
+    :param partial: also accept a partly written record after the last
+    record of the index, which readers skip anyway
+    :return: True if the index can be used
+    """
+    try:
+        index_size = os.path.getsize(path + INDEX_SUFFIX)
+    except FileNotFoundError:
+        return False
+    size = os.path.getsize(path)
+    if index_size % OFFSET.size:
+        return False
+
+    with open(path, 'rb') as f:
+        # End of the last record of the index
+        end = 0
+        if index_size:
+            with open(path + INDEX_SUFFIX, 'rb') as index:
+                index.seek(-OFFSET.size, os.SEEK_END)
+                (offset,) = OFFSET.unpack(index.read(OFFSET.size))
+            f.seek(offset)
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return False
+            magic, flags, _, _, _, _, moves = HEADER.unpack(header)
+            if magic != MAGIC:
+                return False
+            end = offset + record_size(moves, flags)
+        if end == size:
+            return True
+        if not partial or end > size:
+            return False
+
+        # Only a partly written record may follow
+        f.seek(end)
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return True
+        magic, flags, _, _, _, _, moves = HEADER.unpack(header)
+        return magic == MAGIC and end + record_size(moves, flags) > size
+
+
+def repair(path):
+    """
+    Cut a record that was only partly written off the end of an
+    archive, e.g. after a crash, and rebuild its index.
+    :param path: archive file
+    :return: number of complete records
+    """
+    size = os.path.getsize(path)
+    end = 0
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            magic, flags, _, _, _, _, moves = HEADER.unpack(header)
+            if magic != MAGIC or end + record_size(moves, flags) > size:
+                break
+            end += record_size(moves, flags)
+            f.seek(end)
+    if end < size:
+        os.truncate(path, end)
+    return build_index(path)
+
+
+class ArchiveIndex(object):
+    """
+    This class opens single games of an archive through its sidecar
+    index, without scanning the archive. The index is memory-mapped.
+    If the index is missing or does not match the archive, it is
+    built first. A partly written record at the end of the archive is
+    left alone; only a RecordWriter cuts it off.
+    """
+    def __init__(self, path):
+        if not index_is_current(path, partial=True):
+            logging.info(f'Building the index of {path}')
+            build_index(path)
+        self.__archive = open(path, 'rb')
+        self.__index = open(path + INDEX_SUFFIX, 'rb')
+        size = os.fstat(self.__index.fileno()).st_size
+        self.__count = size // OFFSET.size
+
+        # An empty file cannot be mapped
+        self.__offsets = mmap.mmap(self.__index.fileno(), 0,
+                                   access=mmap.ACCESS_READ) if size else None
+
+    def __len__(self):
+        return self.__count
+
+    def __getitem__(self, i):
+        """
+        Read one game.
+        :param i: number of the game, from 0
+        :return: GameRecord
+        """
+        if not 0 <= i < self.__count:
+            raise IndexError(f'No game {i} in the archive')
+        self.__archive.seek(OFFSET.unpack_from(self.__offsets, i * OFFSET.size)[0])
+        return read_record(self.__archive)
+
+    def close(self):
+        """
+        Close the archive and its index.
+        :return: None
+        """
+        if self.__offsets is not None:
+            self.__offsets.close()
+        self.__index.close()
+        self.__archive.close()
+
+
+class RecordWriter(object):
+    """
+    This class appends game records to an archive. Existing records are
+    never rewritten, so a game can be archived as soon as it ends. The
+    offset of every record is appended to the sidecar index as well.
+    An archive whose index does not match, e.g. after a crash, is
+    repaired before anything is appended.
+    """
+    def __init__(self, path):
+        if os.path.exists(path) and not index_is_current(path):
+            logging.warning(f'Repairing {path}')
+            repair(path)
+        self.__file = open(path, 'ab')
+        self.__index = open(path + INDEX_SUFFIX, 'ab')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def write(self, record):
+        """
+        Append a record.
+        :param record: GameRecord
+        :return: offset of the record in the file
+        """
+        offset = self.__file.tell()
+        self.__file.write(encode(record))
+        self.__index.write(OFFSET.pack(offset))
+        return offset
+
+    def flush(self):
+        """
+        Flush buffered records to the file.
+        :return: None
+        """
+        self.__file.flush()
+        self.__index.flush()
+
+    def close(self):
+        """
+        Close the archive.
+        :return: None
+        """
+        self.__file.close()
+        self.__index.close()
@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import logging
+import os
+import signal
+from board_model import Board, WIDTH, HEIGHT, CONNECT
+from engine import init_worker, worker_engine
+
+# Requests of one connection that may be in progress at the same time.
+# When a client has this many, the server stops reading from it.
+MAX_PENDING = 64
+
+# Search depth of engine moves, and the deepest depth a client may ask
+# for; shallower than 1 is searched to depth 1
+DEFAULT_DEPTH = 6
+MAX_DEPTH = 12
+
+# Largest width and height of a board. Tables for a board size are built
+# on the event loop, so huge boards would hold up all clients.
+MAX_SIZE = 16
+
+
+def _best_move(moves, dimensions, depth):
+    """
+    Search a position. Runs in a worker process.
+    :param moves: moves of the position
+    :param dimensions: tuple (width, height, connect)
+    :param depth: search depth
+    :return: best column
+    """
+    return worker_engine().best_move(Board.from_moves(moves, *dimensions), depth)
+
+
+class GameServer(object):
+    """
+    This class hosts headless games for many clients over TCP. Clients
+    send one JSON request per line and get one JSON response per line,
+    with the id of the request. Requests are handled concurrently, so
+    responses may come back in another order; requests on one game are
+    handled in the order they arrive.
+
+    Requests:
+        {"id": 1, "op": "new", "width": 7, "height": 6, "connect": 4}
+        {"id": 2, "op": "move", "game": 1, "col": 3}
+        {"id": 3, "op": "engine", "game": 1, "depth": 6}
+        {"id": 4, "op": "close", "game": 1}
+
+    Engine searches run in a pool of worker processes. At most a few
+    searches per worker are queued; further requests wait, and so do
+    their connections once they have MAX_PENDING requests in progress.
+    With evaluator set, the workers score positions with an Evaluator.
+    """
+    def __init__(self, workers=None, max_pending=MAX_PENDING, evaluator=False):
+        workers = workers or os.cpu_count()
+        self.__pool = concurrent.futures.ProcessPoolExecutor(workers,
+                                                             initializer=init_worker,
+                                                             initargs=(evaluator,))
+        self.__searches = asyncio.Semaphore(4 * workers)
+        self.__max_pending = max_pending
+
+        # Game id -> (Board, lock serialising the requests on the game)
+        self.__games = {}
+        self.__ids = itertools.count(1)
+
+    async def serve(self, host, port):
+        """
+        Accept connections until cancelled.
+        :param host: address to listen on
+        :param port: port to listen on
+        :return: None
+        """
+        # Start the worker processes before accepting connections, so
+        # that they do not inherit client sockets and keep them open
+        await asyncio.get_running_loop().run_in_executor(self.__pool, int)
+
+        server = await asyncio.start_server(self.__handle, host, port)
+        logging.info(f'Serving on {host}:{port}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.__pool.shutdown(cancel_futures=True)
+
+    async def __handle(self, reader, writer):
+        """
+        Serve one connection. Games created on the connection are
+        closed when it closes.
+        """
+        pending = asyncio.Semaphore(self.__max_pending)
+        write_lock = asyncio.Lock()
+        owned = set()
+        tasks = set()
+        try:
+            while True:
+                await pending.acquire()
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The line is over the stream limit and has been skipped
+                    line = None
+                if line == b'':
+                    break
+                task = asyncio.create_task(
+                    self.__serve(line, owned, writer, write_lock, pending))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            for game in owned:
+                self.__games.pop(game, None)
+            writer.close()
+
+    async def __serve(self, line, owned, writer, write_lock, pending):
+        """
+        Handle one request and write its response. Any error is sent
+        back as the response; the request always frees its place among
+        the pending requests of the connection.
+        """
+        try:
+            request_id = None
+            try:
+                if line is None:
+                    raise ValueError('Request too long')
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('Request is not a JSON object')
+                request_id = request.get('id')
+                response = await self.__dispatch(request, owned)
+                response['ok'] = True
+            except Exception as e:
+                if not isinstance(e, (ValueError, KeyError, TypeError)):
+                    logging.exception('Request failed')
+                response = {'ok': False, 'error': str(e) or type(e).__name__}
+            response['id'] = request_id
+
+            try:
+                async with write_lock:
+                    writer.write(json.dumps(response).encode() + b'\n')
+                    await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            pending.release()
+
+    async def __dispatch(self, request, owned):
+        """
+        Carry out a request.
+        :param request: decoded request
+        :param owned: ids of the games of the connection
+        :return: response, without id and status
+        """
+        op = request['op']
+        if op == 'new':
+            width = int(request.get('width', WIDTH))
+            height = int(request.get('height', HEIGHT))
+            connect = int(request.get('connect', CONNECT))
+            if not (0 < width <= MAX_SIZE and 0 < height <= MAX_SIZE and connect > 0):
+                raise ValueError(f'Width and height must be from 1 to {MAX_SIZE}')
+            board = Board(width, height, connect)
+            game = next(self.__ids)
+            self.__games[game] = (board, asyncio.Lock())
+            owned.add(game)
+            return {'game': game}
+
+        # Clients can only use the games they created themselves
+        game = request['game']
+        if game not in owned or game not in self.__games:
+            raise KeyError(f'No game {game}')
+        board, lock = self.__games[game]
+
+        async with lock:
+            if op == 'move':
+                return self.__play(board, int(request['col']))
+            if op == 'engine':
+                if board.is_over():
+                    raise ValueError('Game is over')
+                depth = max(1, min(int(request.get('depth', DEFAULT_DEPTH)), MAX_DEPTH))
+                async with self.__searches:
+                    col = await asyncio.get_running_loop().run_in_executor(
+                        self.__pool, _best_move, board.moves, board.dimensions, depth)
+                return self.__play(board, col)
+            if op == 'close':
+                del self.__games[game]
+                owned.discard(game)
+                return {}
+        raise ValueError(f'Unknown op {op}')
+
+    @staticmethod
+    def __play(board, col):
+        """
+        Play a move and describe the result.
+        :param board: Board to play on
+        :param col: column to play
+        :return: response
+        """
+        row = board.play(col)
+        return {'col': col, 'row': row, 'winner': board.winner, 'over': board.is_over()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve headless Connect4 games')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=4004, help='port to listen on')
+    parser.add_argument('--workers', type=int, help='number of engine processes')
+    parser.add_argument('--evaluator', action='store_true',
+                        help='score positions by open threes and twos; finer but slower')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    # Stop on SIGTERM as on Ctrl-C, so that the workers are shut down too
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    server = GameServer(args.workers, evaluator=args.evaluator)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import logging
+import os
+import random
+import shutil
+import subprocess
+import time
+import tkinter
+from benchmark import write_results
+from breezypythongui import EasyFrame
+from game_board import GameBoard, board_size
+
+COLOURS = ['red', 'yellow', '#707080']
+
+# Seconds to wait for a virtual X server to come up
+DISPLAY_TIMEOUT = 10
+
+
+class CountingTk(object):
+    """
+    This class stands in for the Tcl interpreter of a Tk application
+    and counts the commands sent to it. Every widget created after it
+    is installed on the root window uses it. Timers are not counted:
+    the post queue of EasyFrame keeps rescheduling its poller, which
+    has nothing to do with the operations measured.
+    """
+    def __init__(self, tk):
+        self.__tk = tk
+        self.calls = 0
+
+    def call(self, *args):
+        if args[0] != 'after':
+            self.calls += 1
+        return self.__tk.call(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.__tk, name)
+
+
+def start_display(display=':99'):
+    """
+    Start a virtual X server if there is no display.
+    :param display: display number for the virtual server
+    :return: the server process, or None if there already is a display
+    """
+    if os.environ.get('DISPLAY'):
+        return None
+    xvfb = shutil.which('Xvfb')
+    if xvfb is None:
+        raise RuntimeError('There is no display, and Xvfb is not installed')
+
+    server = subprocess.Popen([xvfb, display, '-screen', '0', '1920x1080x24', '-nolisten', 'tcp'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket_path = f'/tmp/.X11-unix/X{display.lstrip(":")}'
+    deadline = time.monotonic() + DISPLAY_TIMEOUT
+    while not os.path.exists(socket_path):
+        if server.poll() is not None or time.monotonic() > deadline:
+            server.kill()
+            raise RuntimeError(f'Xvfb did not start on {display}')
+        time.sleep(0.05)
+    os.environ['DISPLAY'] = display
+    logging.info(f'Started Xvfb on {display}')
+    return server
+
+
+class GuiBenchmark(object):
+    """
+    This class times GameBoard operations in a real Tk window. For
+    every operation it reports the wall time and the number of Tcl
+    commands (round trips to the interpreter) per operation. Drawing
+    is forced with update_idletasks, so that the time includes it.
+    """
+    def __init__(self, columns=7, rows=6):
+        self.__columns = columns
+        self.__rows = rows
+        self.__root = tkinter.Tk()
+        self.__tk = self.__root.tk = CountingTk(self.__root.tk)
+        self.__frame = EasyFrame()
+        self.results = []
+
+    def __measure(self, name, operation, count, unit='s'):
+        """
+        Run an operation a number of times and record the time and the
+        Tcl commands per run.
+        :param name: name of the result
+        :param operation: function without arguments
+        :param count: number of runs
+        :param unit: unit of the time
+        :return: None
+        """
+        self.__root.update()
+        calls = self.__tk.calls
+        start = time.perf_counter()
+        for _ in range(count):
+            operation()
+        self.__root.update_idletasks()
+        elapsed = (time.perf_counter() - start) / count
+        calls = (self.__tk.calls - calls) / count
+
+        self.results += [
+            {'name': f'gui/{name}/time', 'value': elapsed, 'unit': unit},
+            {'name': f'gui/{name}/tcl-calls', 'value': calls, 'unit': 'calls'},
+        ]
+        logging.info(f'{name}: {elapsed * 1e3:.3f}ms and {calls:.1f} Tcl calls per run')
+
+    def __new_board(self, cell_size=100):
+        board = GameBoard(self.__frame, *board_size(self.__columns, self.__rows, cell_size),
+                          columns=self.__columns, rows=self.__rows, cell_size=cell_size)
+        self.__frame.addCanvas(board)
+        return board
+
+    def run(self, count=20, updates=10000):
+        """
+        Run all measurements.
+        :param count: number of runs of the slow operations
+        :param updates: number of cell updates
+        :return: list of results
+        """
+        columns, rows = self.__columns, self.__rows
+
+        def build():
+            self.__new_board().destroy()
+
+        self.__measure('build', build, count)
+
+        board = self.__new_board()
+        cells = [(random.randrange(columns), random.randrange(rows), random.choice(COLOURS))
+                 for _ in range(updates)]
+        cell_iter = iter(cells)
+        self.__measure('update-cell', lambda: board.update_cell(*next(cell_iter)), updates)
+
+        colours = iter(range(count))
+
+        def redraw():
+            colour = COLOURS[next(colours) % 2]
+            for col in range(columns):
+                for row in range(rows):
+                    board.update_cell(col, row, colour)
+
+        self.__measure('redraw', redraw, count)
+
+        sizes = iter(range(count))
+
+        def resize():
+            # Relayout of the window around a board of another size; the
+            # board itself is laid out once, see rebuild
+            width, height = board_size(columns, rows, 60 + 40 * (next(sizes) % 2))
+            board.configure(width=width, height=height)
+            self.__root.update()
+
+        self.__measure('resize', resize, count)
+
+        sizes = iter(range(count))
+
+        def rebuild():
+            # Boards are laid out once, so another cell size means a new board
+            nonlocal board
+            board.destroy()
+            board = self.__new_board(60 + 40 * (next(sizes) % 2))
+            self.__root.update()
+
+        self.__measure('rebuild', rebuild, count)
+        self.__root.destroy()
+        return self.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the GUI')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--display', default=':99',
+                        help='display of the virtual X server, if there is no display')
+    args = parser.parse_args()
+
+    try:
+        server = start_display(args.display)
+    except RuntimeError as e:
+        parser.error(str(e))
+    try:
+        write_results('gui', GuiBenchmark().run(), args.output)
+    finally:
+        if server is not None:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import logging
+import os
+import struct
+import time
+from game_record import GameRecord, encode, read_record
+
+# The journal starts with a header holding its epoch; after that, every
+# move is one byte with the column. The snapshot holds the epoch and the
+# journal offset it covers, followed by the game as a game record.
+JOURNAL_MAGIC = b'C4JN'
+SNAPSHOT_MAGIC = b'C4SN'
+JOURNAL_HEADER = struct.Struct('<4sI')
+SNAPSHOT_HEADER = struct.Struct('<4sIQ')
+SNAPSHOT_SUFFIX = '.snap'
+
+# Seconds between fsyncs of the journal
+SYNC_INTERVAL = 1.0
+
+# Moves between snapshots
+SNAPSHOT_INTERVAL = 16
+
+
+def _write_atomic(path, data):
+    """
+    Replace a file with new contents, so that a crash leaves either
+    the old or the new file.
+    :param path: file to replace
+    :param data: bytes to write
+    :return: None
+    """
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def restore(path):
+    """
+    Read the game saved in a journal: the latest snapshot plus the
+    moves journalled after it.
+    :param path: journal file
+    :return: tuple (dimensions, moves), or None if there is no game
+    """
+    try:
+        with open(path + SNAPSHOT_SUFFIX, 'rb') as f:
+            magic, epoch, offset = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+            record = read_record(f)
+    except (FileNotFoundError, struct.error, EOFError):
+        return None
+    if magic != SNAPSHOT_MAGIC or record is None:
+        return None
+    moves = record.moves
+
+    # A journal of another epoch was not started or not finished
+    # after the snapshot was written; the snapshot is all there is
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b''
+    if len(data) >= JOURNAL_HEADER.size and \
+            JOURNAL_HEADER.unpack_from(data) == (JOURNAL_MAGIC, epoch):
+        for col in data[offset:]:
+            if col >= record.width:
+                break
+            moves.append(col)
+    return record.dimensions, moves
+
+
+class Journal(object):
+    """
+    This class saves the game in progress, so that it survives a crash.
+    Every move is appended to the journal as a single one-byte write;
+    the journal is fsynced at most once per sync interval. The owner
+    calls {sync} once per interval as well, so that no move stays
+    unsynced while the game pauses. Every few moves, a snapshot of the
+    whole game is written next to it. A game is restored from the
+    snapshot plus the few moves journalled after it; see {restore}.
+
+    Starting a game writes a snapshot of the new game, then starts a new
+    journal with the next epoch number. A journal of another epoch than
+    the snapshot is ignored, so a crash in between is harmless.
+    """
+    def __init__(self, path, sync_interval=SYNC_INTERVAL,
+                 snapshot_interval=SNAPSHOT_INTERVAL):
+        self.__path = path
+        self.__sync_interval = sync_interval
+        self.__snapshot_interval = snapshot_interval
+        self.__file = None
+        self.__epoch = 0
+        self.__dimensions = None
+        self.__moves = []
+        self.__last_sync = 0
+        self.__unsynced = False
+
+        # Continue after the epoch of an existing snapshot
+        try:
+            with open(path + SNAPSHOT_SUFFIX, 'rb') as f:
+                _, self.__epoch, _ = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+        except (FileNotFoundError, struct.error):
+            pass
+
+    def start(self, dimensions, moves=()):
+        """
+        Start journalling a game, e.g. a new one or a restored one.
+        :param dimensions: tuple (width, height, connect)
+        :param moves: moves already played
+        :return: None
+        """
+        self.close()
+        self.__epoch += 1
+        self.__dimensions = dimensions
+        self.__moves = list(moves)
+        self.snapshot()
+
+        self.__file = open(self.__path, 'wb', buffering=0)
+        self.__file.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, self.__epoch))
+        os.fsync(self.__file.fileno())
+        self.__last_sync = time.monotonic()
+        self.__unsynced = False
+        logging.debug(f'Journal epoch {self.__epoch}, {len(self.__moves)} moves')
+
+    @property
+    def sync_interval(self):
+        """Longest time in seconds that a journalled move may stay unsynced."""
+        return self.__sync_interval
+
+    def record(self, col):
+        """
+        Append a move to the journal.
+        :param col: column played
+        :return: None
+        """
+        self.__file.write(bytes((col,)))
+        self.__moves.append(col)
+        self.__unsynced = True
+
+        if len(self.__moves) % self.__snapshot_interval == 0:
+            self.snapshot()
+        elif time.monotonic() - self.__last_sync >= self.__sync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+        Make sure that all journalled moves are on disk.
+        :return: None
+        """
+        if self.__unsynced:
+            os.fsync(self.__file.fileno())
+            self.__unsynced = False
+        self.__last_sync = time.monotonic()
+
+    def snapshot(self):
+        """
+        Write a snapshot of the game. It replaces the previous snapshot
+        and covers everything journalled so far.
+        :return: None
+        """
+        # Without an open journal, the new journal will start empty
+        offset = JOURNAL_HEADER.size
+        if self.__file is not None:
+            self.sync()
+            offset = self.__file.tell()
+        record = GameRecord(self.__moves, width=self.__dimensions[0],
+                            height=self.__dimensions[1], connect=self.__dimensions[2])
+        _write_atomic(self.__path + SNAPSHOT_SUFFIX,
+                      SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.__epoch, offset) + encode(record))
+
+    def close(self):
+        """
+        Sync and close the journal.
+        :return: None
+        """
+        if self.__file is not None:
+            self.sync()
+            self.__file.close()
+            self.__file = None
@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from board_model import Board
+
+
+class Connection(object):
+    """
+    This class sends requests to the game server over one connection.
+    Requests are pipelined: many can be outstanding at the same time,
+    and responses are matched to requests by their id.
+    """
+    def __init__(self, reader, writer):
+        self.__reader = reader
+        self.__writer = writer
+        self.__ids = itertools.count(1)
+        self.__waiting = {}
+        self.__task = asyncio.create_task(self.__read_loop())
+
+        # Latency of every request, in seconds
+        self.latencies = []
+
+    @classmethod
+    async def open(cls, host, port):
+        """
+        Connect to a server.
+        :return: Connection
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, **fields):
+        """
+        Send a request and wait for its response.
+        :param fields: fields of the request
+        :return: decoded response
+        """
+        request_id = next(self.__ids)
+        future = asyncio.get_running_loop().create_future()
+        self.__waiting[request_id] = future
+
+        start = time.perf_counter()
+        fields['id'] = request_id
+        self.__writer.write(json.dumps(fields).encode() + b'\n')
+        await self.__writer.drain()
+        response = await future
+        self.latencies.append(time.perf_counter() - start)
+
+        if not response['ok']:
+            raise ValueError(response['error'])
+        return response
+
+    async def __read_loop(self):
+        """
+        Hand every response to the request waiting for it.
+        """
+        while True:
+            line = await self.__reader.readline()
+            if not line:
+                break
+            response = json.loads(line)
+            future = self.__waiting.pop(response['id'], None)
+            if future is not None:
+                future.set_result(response)
+        for future in self.__waiting.values():
+            future.set_exception(ConnectionError('Connection closed'))
+
+    async def close(self):
+        """
+        Close the connection.
+        :return: None
+        """
+        self.__writer.close()
+        await self.__writer.wait_closed()
+        self.__task.cancel()
+
+
+async def play_game(connection, depth):
+    """
+    Play one game of random moves against the server's engine.
+    :param connection: Connection to play over
+    :param depth: search depth of the engine
+    :return: number of moves played
+    """
+    game = (await connection.request(op='new'))['game']
+    board = Board()
+    while True:
+        col = random.choice(board.legal_moves())
+        response = await connection.request(op='move', game=game, col=col)
+        board.play(col)
+        if response['over']:
+            break
+        response = await connection.request(op='engine', game=game, depth=depth)
+        board.play(response['col'])
+        if response['over']:
+            break
+    await connection.request(op='close', game=game)
+    return board.move_count
+
+
+def percentile(values, fraction):
+    """
+    Return a percentile of a sorted list.
+    :param values: sorted list
+    :param fraction: e.g. 0.99 for the 99th percentile
+    :return: value
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def run(host, port, games, connections, depth):
+    """
+    Play many games at the same time and report throughput and latency.
+    :param host: server address
+    :param port: server port
+    :param games: number of games played at the same time
+    :param connections: number of connections to spread the games over
+    :param depth: search depth of the engine
+    :return: None
+    """
+    pool = [await Connection.open(host, port) for _ in range(connections)]
+    start = time.perf_counter()
+    moves = await asyncio.gather(*(play_game(pool[i % connections], depth)
+                                   for i in range(games)))
+    elapsed = time.perf_counter() - start
+    for connection in pool:
+        await connection.close()
+
+    latencies = sorted(itertools.chain.from_iterable(c.latencies for c in pool))
+    logging.info(f'{games} games, {sum(moves)} moves in {elapsed:.1f}s: '
+                 f'{sum(moves) / elapsed:.0f} moves/s')
+    logging.info(f'latency p50 {percentile(latencies, 0.5) * 1000:.1f}ms, '
+                 f'p90 {percentile(latencies, 0.9) * 1000:.1f}ms, '
+                 f'p99 {percentile(latencies, 0.99) * 1000:.1f}ms, '
+                 f'max {latencies[-1] * 1000:.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the game server')
+    parser.add_argument('--host', default='127.0.0.1', help='server address')
+    parser.add_argument('--port', type=int, default=4004, help='server port')
+    parser.add_argument('--games', type=int, default=10000,
+                        help='number of games played at the same time')
+    parser.add_argument('--connections', type=int, default=100,
+                        help='number of connections')
+    parser.add_argument('--depth', type=int, default=2, help='search depth of the engine')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args.host, args.port, args.games, args.connections, args.depth))
+
+
+if __name__ == '__main__':
+    main()
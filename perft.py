@@ -0,0 +1,118 @@
+import argparse
+import logging
+import sys
+import time
+from board_model import Board, CONNECT, HEIGHT, WIDTH, add_dimension_arguments
+
+logging.basicConfig(level=logging.INFO)
+
+# Number of move sequences from the empty 7x6 board, by depth. Games end
+# when a player connects four, so won positions are not expanded.
+REFERENCE_COUNTS = {
+    1: 7,
+    2: 49,
+    3: 343,
+    4: 2401,
+    5: 16807,
+    6: 117649,
+    7: 823536,
+    8: 5673234,
+}
+
+
+def perft(board, depth):
+    """
+    Count all legal move sequences of a given length. At the last ply
+    the moves are counted without being played.
+    :param board: Board to start from; it is restored afterwards
+    :param depth: number of plies
+    :return: number of move sequences
+    """
+    moves = board.legal_moves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+
+    nodes = 0
+    for col in moves:
+        board.play(col)
+        if board.winner is None:
+            nodes += perft(board, depth - 1)
+        board.unplay()
+    return nodes
+
+
+def divide(board, depth):
+    """
+    Count the move sequences of a given length per first move.
+    :param board: Board to start from; it is restored afterwards
+    :param depth: number of plies, at least 1
+    :return: dict of column -> number of move sequences
+    """
+    counts = {}
+    for col in board.legal_moves():
+        board.play(col)
+        counts[col] = perft(board, depth - 1) if board.winner is None else 0
+        board.unplay()
+    return counts
+
+
+def check(max_depth):
+    """
+    Compare the counts from the empty board with the reference counts.
+    :param max_depth: deepest depth to check
+    :return: True if all counts match
+    """
+    ok = True
+    for depth in range(1, max_depth + 1):
+        expected = REFERENCE_COUNTS.get(depth)
+        if expected is None:
+            break
+        start = time.perf_counter()
+        nodes = perft(Board(), depth)
+        elapsed = time.perf_counter() - start
+        status = 'ok' if nodes == expected else f'FAILED, expected {expected}'
+        logging.info(f'perft({depth}) = {nodes} in {elapsed:.3f}s '
+                     f'({nodes / max(elapsed, 1e-9):.0f} nodes/s) {status}')
+        ok = ok and nodes == expected
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Count move sequences to validate and time move generation')
+    parser.add_argument('depth', type=int, help='number of plies')
+    parser.add_argument('--moves', default='',
+                        help='start position as a string of columns, e.g. 3344')
+    parser.add_argument('--divide', action='store_true',
+                        help='show the count for every first move')
+    parser.add_argument('--check', action='store_true',
+                        help='compare counts from the empty standard board with known values')
+    add_dimension_arguments(parser)
+    args = parser.parse_args()
+
+    if args.check:
+        # The reference counts are only known for the empty standard board
+        if args.moves or (args.width, args.height, args.connect) != (WIDTH, HEIGHT, CONNECT):
+            parser.error(f'--check only works from the empty {WIDTH}x{HEIGHT} board '
+                         f'connecting {CONNECT}')
+        sys.exit(0 if check(args.depth) else 1)
+
+    board = Board.from_moves((int(c) for c in args.moves),
+                             args.width, args.height, args.connect)
+    start = time.perf_counter()
+    if args.divide:
+        counts = divide(board, args.depth)
+        for col, nodes in counts.items():
+            print(f'{col}: {nodes}')
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(board, args.depth)
+    elapsed = time.perf_counter() - start
+
+    print(f'nodes: {nodes}')
+    print(f'time: {elapsed:.3f}s')
+    print(f'nodes/s: {nodes / max(elapsed, 1e-9):.0f}')
+
+
+if __name__ == '__main__':
+    main()
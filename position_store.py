@@ -0,0 +1,206 @@
+import logging
+import queue
+import sqlite3
+import threading
+
+# Number of rows written per transaction
+BATCH_SIZE = 10000
+
+# Seconds the background writer waits for more rows before committing
+FLUSH_INTERVAL = 1.0
+
+
+def _table(geometry):
+    """
+    Return the name of the table for a board size.
+    :param geometry: Geometry of the board size
+    :return: table name
+    """
+    return f'positions_{geometry.width}x{geometry.height}_{geometry.connect}'
+
+
+def _encode_key(geometry, key):
+    """
+    Encode a canonical key as a blob. SQLite integers are signed 64-bit,
+    which is too small for the keys of larger boards.
+    :param geometry: Geometry of the board size
+    :param key: canonical key
+    :return: bytes
+    """
+    return key.to_bytes((geometry.bits + 7) // 8, 'big')
+
+
+class PositionStore(object):
+    """
+    This class keeps analysis results between sessions in an SQLite
+    database: score, depth and best move of positions, under their
+    canonical key. Best moves are stored as seen from the canonical
+    side. There is one table per board size.
+
+    Results passed to {put} are written by a background thread in
+    batched transactions, so the search never waits for the disk.
+    """
+    def __init__(self, path):
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__connection = self.__connect()
+        self.__tables = set()
+
+        self.__queue = queue.Queue()
+        self.__writer = threading.Thread(target=self.__write_loop, daemon=True)
+        self.__writer.start()
+
+    def __connect(self):
+        """
+        Open a connection. WAL mode lets lookups run while the
+        background writer commits.
+        :return: sqlite3.Connection
+        """
+        connection = sqlite3.connect(self.__path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def __ensure_table(self, connection, geometry):
+        """
+        Create the table of a board size if it does not exist.
+        :param connection: connection to create it with
+        :param geometry: Geometry of the board size
+        :return: table name
+        """
+        table = _table(geometry)
+        if table not in self.__tables:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ('
+                               'key BLOB PRIMARY KEY, score INTEGER, '
+                               'depth INTEGER, best_move INTEGER) WITHOUT ROWID')
+            connection.commit()
+            self.__tables.add(table)
+        return table
+
+    def get(self, board):
+        """
+        Look up a position.
+        :param board: Board to look up
+        :return: tuple (score, depth, best move) or None
+        """
+        geometry = board.geometry
+        key, mirrored = board.canonical_key()
+        with self.__lock:
+            table = self.__ensure_table(self.__connection, geometry)
+            row = self.__connection.execute(
+                f'SELECT score, depth, best_move FROM {table} WHERE key = ?',
+                (_encode_key(geometry, key),)).fetchone()
+        if row is None:
+            return None
+        score, depth, best_move = row
+        if mirrored and best_move is not None:
+            best_move = geometry.mirror_move(best_move)
+        return score, depth, best_move
+
+    def put(self, board, score, depth, best_move):
+        """
+        Queue the result of a position for writing. An existing result
+        is only replaced by a deeper one.
+        :param board: Board of the position
+        :param score: score for the player to move
+        :param depth: depth of the search
+        :param best_move: best column, or None
+        :return: None
+        """
+        geometry = board.geometry
+        key, mirrored = board.canonical_key()
+        if mirrored and best_move is not None:
+            best_move = geometry.mirror_move(best_move)
+        self.__queue.put((geometry, (_encode_key(geometry, key), score, depth, best_move)))
+
+    def import_rows(self, geometry, rows, batch_size=BATCH_SIZE):
+        """
+        Bulk insert results, in transactions of batch_size rows.
+        :param geometry: Geometry of the board size
+        :param rows: iterable of (canonical key, score, depth, best move)
+        :param batch_size: rows per transaction
+        :return: number of rows inserted
+        """
+        count = 0
+        batch = []
+        for key, score, depth, best_move in rows:
+            batch.append((_encode_key(geometry, key), score, depth, best_move))
+            if len(batch) >= batch_size:
+                count += self.__insert(geometry, batch)
+                batch = []
+        if batch:
+            count += self.__insert(geometry, batch)
+        return count
+
+    def __insert(self, geometry, batch, connection=None):
+        """
+        Insert a batch of encoded rows in one transaction.
+        :param geometry: Geometry of the board size
+        :param batch: list of encoded rows
+        :param connection: connection to use, default the shared one
+        :return: number of rows
+        """
+        if connection is None:
+            with self.__lock:
+                return self.__insert(geometry, batch, self.__connection)
+
+        table = self.__ensure_table(connection, geometry)
+        with connection:
+            connection.executemany(
+                f'INSERT INTO {table} VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET score = excluded.score, '
+                'depth = excluded.depth, best_move = excluded.best_move '
+                'WHERE excluded.depth > depth', batch)
+        return len(batch)
+
+    def __write_loop(self):
+        """
+        Background writer: collect queued results and write them in
+        batches, per board size, on its own connection.
+        :return: None
+        """
+        connection = self.__connect()
+        try:
+            self.__drain(connection)
+        finally:
+            connection.close()
+
+    def __drain(self, connection):
+        """
+        Write queued results until the queue is closed.
+        :param connection: connection of the writer thread
+        :return: None
+        """
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            batches = {}
+            while item is not None:
+                geometry, row = item
+                batches.setdefault(geometry, []).append(row)
+                if sum(len(b) for b in batches.values()) >= BATCH_SIZE:
+                    break
+                try:
+                    item = self.__queue.get(timeout=FLUSH_INTERVAL)
+                except queue.Empty:
+                    break
+            for geometry, batch in batches.items():
+                # A failed batch is lost, but the writer keeps going
+                try:
+                    self.__insert(geometry, batch, connection)
+                except sqlite3.Error as e:
+                    logging.warning(f'Could not write {len(batch)} results to {self.__path}: {e}')
+            if item is None:
+                return
+
+    def close(self):
+        """
+        Write all queued results and close the database.
+        :return: None
+        """
+        self.__queue.put(None)
+        self.__writer.join()
+        with self.__lock:
+            self.__connection.close()
+        logging.debug(f'Closed {self.__path}')
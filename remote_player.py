@@ -0,0 +1,268 @@
+import itertools
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from board_model import CONNECT, HEIGHT, WIDTH
+
+# Seconds to wait before reconnecting; doubled after every failed attempt
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 8.0
+
+
+class RemotePlayer(object):
+    """
+    This class lets the engine of a game server (see game_server.py)
+    play one side of the game. It has the interface of {EnginePlayer}:
+    {request} a move, then {poll} until it is there.
+
+    The connection is served by two background threads, so the GUI
+    never waits for the network. Moves are sent as soon as they are
+    played, without waiting for the responses to earlier requests. The
+    reply of the engine is kept in a single slot, which a newer reply
+    replaces. When the connection drops, the player reconnects and
+    replays the game on the server.
+    """
+    def __init__(self, host='127.0.0.1', port=4004, depth=8,
+                 dimensions=(WIDTH, HEIGHT, CONNECT)):
+        self.__address = (host, port)
+        self.__depth = depth
+        self.__dimensions = dimensions
+        self.__lock = threading.Lock()
+        self.__stopped = False
+
+        # Encoded requests to send, tagged with the connection they are for
+        self.__outbox = queue.Queue()
+        self.__connection = 0
+        self.__socket = None
+        self.__ids = itertools.count(1)
+
+        # Requests in flight: id -> (op, time sent)
+        self.__pending = {}
+
+        # Game on the server, the moves sent to it, and the moves it should have
+        self.__game = None
+        self.__sent = ()
+        self.__wanted = ()
+
+        # Whether a move is wanted, the id of the engine request in flight,
+        # and the latest reply as (moves, column, response time)
+        self.__engine_wanted = False
+        self.__engine_request = None
+        self.__reply = None
+
+        # Called on the reader thread when a reply comes in
+        self.__on_reply = None
+
+        # Statistics. The server does not ponder.
+        self.requests = 0
+        self.ponder_hits = 0
+        self.total_response_time = 0.0
+        self.last_round_trip = None
+        self.reconnects = 0
+        self.status = 'connecting'
+
+        threading.Thread(target=self.__read_loop, daemon=True).start()
+        threading.Thread(target=self.__write_loop, daemon=True).start()
+
+    @property
+    def mean_response_time(self):
+        """Average time in seconds between a request and the reply."""
+        return self.total_response_time / self.requests if self.requests else 0.0
+
+    def set_reply_handler(self, handler):
+        """
+        Set a function without arguments that is called when a reply
+        comes in. It is called on the reader thread, so it should only
+        hand over to the GUI thread, e.g. with {EasyFrame.post}; the
+        GUI then calls {poll}.
+        :param handler: Function to call
+        :return: None
+        """
+        self.__on_reply = handler
+
+    def request(self, board):
+        """
+        Ask for a move in a position. The moves that the server does not
+        have yet are sent along with the request.
+        :param board: Board in which the engine is to move
+        :return: None
+        """
+        with self.__lock:
+            self.__wanted = board.moves
+            self.__engine_wanted = True
+            self.__reply = None
+            self.requests += 1
+            self.__sync()
+
+    def poll(self):
+        """
+        Return the move for the requested position once it is known.
+        :return: column, or None while the server is still thinking
+        """
+        with self.__lock:
+            if self.__reply is None or self.__reply[0] != self.__wanted:
+                return None
+            _, col, elapsed = self.__reply
+            self.__reply = None
+        self.total_response_time += elapsed
+        return col
+
+    def ponder(self, board):
+        """
+        The server does not ponder; nothing to do.
+        :param board: Board after the engine's own move
+        :return: None
+        """
+
+    def stop(self):
+        """
+        Close the connection. The player cannot be used after this.
+        :return: None
+        """
+        with self.__lock:
+            self.__stopped = True
+            self.__drop()
+        self.__outbox.put(None)
+
+    def __send(self, op, **fields):
+        """
+        Queue a request on the current connection. Call with the lock held.
+        :param op: operation
+        :param fields: other fields of the request
+        :return: id of the request
+        """
+        request_id = next(self.__ids)
+        fields.update(id=request_id, op=op)
+        self.__pending[request_id] = (op, time.perf_counter())
+        self.__outbox.put((self.__connection, json.dumps(fields).encode() + b'\n'))
+        return request_id
+
+    def __sync(self):
+        """
+        Send the moves the server does not have yet, and the engine
+        request if one is wanted. Call with the lock held.
+        :return: None
+        """
+        if self.__game is None:
+            return
+        if self.__wanted[:len(self.__sent)] != self.__sent:
+            # The game went another way than the server's; start over
+            self.__drop()
+            return
+
+        for col in self.__wanted[len(self.__sent):]:
+            self.__send('move', game=self.__game, col=col)
+        self.__sent = self.__wanted
+        if self.__engine_wanted and self.__engine_request is None:
+            self.__engine_request = self.__send('engine', game=self.__game,
+                                                depth=self.__depth)
+
+    def __drop(self):
+        """
+        Shut down the current connection; the reader reconnects. Call
+        with the lock held.
+        :return: None
+        """
+        if self.__socket is not None:
+            try:
+                self.__socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __receive(self, response):
+        """
+        Handle one response. Call with the lock held.
+        :param response: decoded response
+        :return: None
+        """
+        op, sent_at = self.__pending.pop(response['id'], (None, 0))
+        elapsed = time.perf_counter() - sent_at
+        if not response['ok']:
+            logging.warning(f'Server refused {op}: {response["error"]}')
+            self.__drop()
+            return
+
+        if op == 'new':
+            self.__game = response['game']
+            self.status = 'connected'
+            self.__sync()
+        elif op == 'move':
+            self.last_round_trip = elapsed
+        elif op == 'engine' and response['id'] == self.__engine_request:
+            self.__engine_request = None
+            self.__engine_wanted = False
+            moves = self.__sent
+            self.__sent += (response['col'],)
+            self.__reply = (moves, response['col'], elapsed)
+            if self.__on_reply is not None:
+                self.__on_reply()
+
+    def __read_loop(self):
+        """
+        Reader thread: connect, (re)create the game on the server and
+        handle responses, until stopped.
+        :return: None
+        """
+        delay = RECONNECT_DELAY
+        while not self.__stopped:
+            try:
+                sock = socket.create_connection(self.__address)
+            except OSError as e:
+                self.status = f'offline ({e.strerror or e})'
+                time.sleep(delay)
+                delay = min(2 * delay, MAX_RECONNECT_DELAY)
+                continue
+            delay = RECONNECT_DELAY
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            with self.__lock:
+                self.__connection += 1
+                self.__socket = sock
+                self.__pending = {}
+                self.__game = None
+                self.__sent = ()
+                self.__engine_request = None
+                width, height, connect = self.__dimensions
+                self.__send('new', width=width, height=height, connect=connect)
+
+            try:
+                for line in sock.makefile('rb'):
+                    with self.__lock:
+                        self.__receive(json.loads(line))
+            except (OSError, ValueError) as e:
+                logging.warning(f'Connection to server lost: {e}')
+
+            with self.__lock:
+                self.__socket = None
+            sock.close()
+            if not self.__stopped:
+                self.reconnects += 1
+                self.status = 'reconnecting'
+                time.sleep(delay)
+
+    def __write_loop(self):
+        """
+        Writer thread: send queued requests. Requests that are queued
+        together are sent in one write.
+        :return: None
+        """
+        while True:
+            items = [self.__outbox.get()]
+            while not self.__outbox.empty():
+                items.append(self.__outbox.get())
+            if None in items:
+                return
+
+            with self.__lock:
+                connection, sock = self.__connection, self.__socket
+            data = b''.join(d for c, d in items if c == connection)
+            if sock is None or not data:
+                continue
+            try:
+                sock.sendall(data)
+            except OSError:
+                # The reader notices too, and reconnects
+                pass
@@ -0,0 +1,157 @@
+import argparse
+import logging
+from board_model import Board
+from breezypythongui import EasyFrame
+from game_board import GameBoard, board_size, chip_cells
+from game_record import ArchiveIndex
+
+COLOURS = ['red', 'yellow']
+EMPTY = '#707080'
+
+# Board state is checkpointed every this many plies
+CHECKPOINT_INTERVAL = 8
+
+
+class ReplayViewer(EasyFrame):
+    """
+    This class shows the games of an archive move by move. Only the
+    selected game is read, through the sidecar index of the archive.
+    The board state is checkpointed every few plies, so any move can
+    be shown by replaying at most a few moves from a checkpoint. Only
+    the cells that differ from what is on the board are redrawn.
+    Clicking the board shows the next move.
+    """
+    def __init__(self, path, checkpoint_interval=CHECKPOINT_INTERVAL):
+        EasyFrame.__init__(self, title='Connect4 replay')
+        self.__archive = ArchiveIndex(path)
+        self.__interval = checkpoint_interval
+
+        # Board and its size, replaced when a game of another size is loaded
+        self.__board = None
+        self.__dimensions = None
+
+        # Cell (col, row) of every move of the game, with row 0 at the top
+        self.__cells = []
+        self.__winning_cells = None
+        self.__checkpoints = []
+
+        # Colour of every coloured cell on the board, and the ply shown
+        self.__shown = {}
+        self.__ply = 0
+        self.__game = 0
+
+        self.addLabel('Game', 1, 0)
+        self.__game_field = self.addIntegerField(0, 1, 1, width=8)
+        self.addButton('Load', 1, 2, command=self.__load_clicked)
+        self.addButton('<<', 1, 3, command=lambda: self.show(0))
+        self.addButton('<', 1, 4, command=lambda: self.show(self.__ply - 1))
+        self.addButton('>', 1, 5, command=lambda: self.show(self.__ply + 1))
+        self.addButton('>>', 1, 6, command=lambda: self.show(len(self.__cells)))
+        self.addLabel('Move', 1, 7)
+        self.__move_field = self.addIntegerField(0, 1, 8, width=5)
+        self.addButton('Go', 1, 9, command=self.__go_clicked)
+
+        if len(self.__archive):
+            self.__load_clicked()
+
+    def load(self, game):
+        """
+        Load a game from the archive and show its start position.
+        :param game: number of the game, from 0
+        :return: None
+        """
+        try:
+            record = self.__archive[game]
+        except EOFError:
+            record = None
+        if record is None:
+            raise ValueError(f'Game {game} cannot be read')
+        self.__game = game
+        width, height, _ = record.dimensions
+
+        if record.dimensions != self.__dimensions:
+            if self.__board is not None:
+                self.__board.destroy()
+            # A click steps through the game, so fast clicks must all count
+            self.__board = GameBoard(self, *board_size(width, height, extra=0.7),
+                                     columns=width, rows=height, debounce=0)
+            self.__board.set_click_handler(lambda *_: self.show(self.__ply + 1))
+            self.addCanvas(self.__board, row=0, column=0, columnspan=10)
+            self.__dimensions = record.dimensions
+            self.__shown = {}
+
+        # Work out where every chip lands, and checkpoint the board
+        state = {}
+        self.__cells = chip_cells(record.moves, width, height)
+        self.__checkpoints = []
+        for ply, cell in enumerate(self.__cells):
+            if ply % self.__interval == 0:
+                self.__checkpoints.append(dict(state))
+            state[cell] = COLOURS[ply & 1]
+        if len(record.moves) % self.__interval == 0:
+            self.__checkpoints.append(state)
+
+        board = Board.from_moves(record.moves, *record.dimensions)
+        self.__winning_cells = None
+        if board.winning_line is not None:
+            self.__winning_cells = [(c, height - 1 - r)
+                                    for c, r in board.line_cells(board.winning_line)]
+
+        self.__game_field.setNumber(game)
+        self.show(0)
+
+    def show(self, ply):
+        """
+        Show the position after a number of moves of the loaded game.
+        :param ply: number of moves; clamped to the length of the game
+        :return: None
+        """
+        if self.__board is None:
+            return
+        ply = max(0, min(ply, len(self.__cells)))
+        base = ply - ply % self.__interval
+        state = dict(self.__checkpoints[base // self.__interval])
+        for i in range(base, ply):
+            state[self.__cells[i]] = COLOURS[i & 1]
+
+        for cell in self.__shown.keys() | state.keys():
+            colour = state.get(cell, EMPTY)
+            if self.__shown.get(cell, EMPTY) != colour:
+                self.__board.update_cell(*cell, colour)
+        self.__shown = state
+        self.__ply = ply
+
+        if ply == len(self.__cells) and self.__winning_cells is not None:
+            self.__board.show_line(self.__winning_cells)
+        else:
+            self.__board.hide_line()
+        self.__move_field.setNumber(ply)
+        self.__board.set_status(f'Game {self.__game} of {len(self.__archive)}, '
+                                f'move {ply} of {len(self.__cells)}')
+
+    def __load_clicked(self):
+        try:
+            self.load(self.__game_field.getNumber())
+        except (ValueError, IndexError) as e:
+            self.messageBox('Replay', str(e))
+
+    def __go_clicked(self):
+        try:
+            self.show(self.__move_field.getNumber())
+        except ValueError as e:
+            self.messageBox('Replay', str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay archived Connect4 games')
+    parser.add_argument('archive', help='game archive')
+    parser.add_argument('--interval', type=int, default=CHECKPOINT_INTERVAL,
+                        help='checkpoint the board every this many plies')
+    args = parser.parse_args()
+
+    logging.info(f'Opening {args.archive}')
+    ReplayViewer(args.archive, args.interval).mainloop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+import argparse
+import bisect
+import logging
+import mmap
+import multiprocessing
+import struct
+import time
+from board_model import Board, get_geometry, WIDTH, HEIGHT, CONNECT, add_dimension_arguments
+
+# Results, from the point of view of the player to move. UNKNOWN means
+# that the position is not in the tablebase.
+UNKNOWN, LOSS, DRAW, WIN = 0, 1, 2, 3
+
+# File layout: header, sorted canonical keys, then 2 bits per result.
+# Keys are stored as 64-bit integers when the board fits in 64 bits,
+# and as big-endian byte strings of the bitboard size otherwise.
+MAGIC = b'C4TB'
+VERSION = 2
+HEADER = struct.Struct('<4sBBBBBQ')
+KEY = struct.Struct('<Q')
+
+
+def _key_size(geometry):
+    """
+    Return the number of bytes per key in the file.
+    :param geometry: Geometry of the board size
+    :return: number of bytes
+    """
+    return KEY.size if geometry.fits_64 else (geometry.bits + 7) // 8
+
+
+def _pack_key(geometry, key):
+    """
+    Encode a key for the file.
+    :param geometry: Geometry of the board size
+    :param key: canonical key
+    :return: bytes
+    """
+    if geometry.fits_64:
+        return KEY.pack(key)
+    return key.to_bytes(_key_size(geometry), 'big')
+
+
+def _frontier(root, max_empty, dimensions):
+    """
+    Collect the positions below a root that have exactly max_empty
+    empty cells, or the root itself if it has no more than that. The
+    positions are expanded level by level, and positions that are
+    reached by several move orders are expanded only once.
+    :param root: tuple of moves of the root position
+    :param max_empty: maximum number of empty cells
+    :param dimensions: tuple (width, height, connect) of the board
+    :return: dict of canonical key -> moves
+    """
+    board = Board.from_moves(root, *dimensions)
+    if board.winner is not None or board.is_full():
+        return {}
+    level = {board.canonical_key()[0]: board.moves}
+    while board.empty_count > max_empty:
+        children = {}
+        for moves in level.values():
+            board = Board.from_moves(moves, *dimensions)
+            for col in board.legal_moves():
+                board.play(col)
+                if board.winner is None and not board.is_full():
+                    children.setdefault(board.canonical_key()[0], board.moves)
+                board.unplay()
+        if not children:
+            return {}
+        level = children
+        board = Board.from_moves(next(iter(level.values())), *dimensions)
+    return level
+
+
+def _solve(task):
+    """
+    Solve all positions below a list of roots by retrograde analysis:
+    first all positions are enumerated level by level, then they are
+    solved from the last level (full boards) back to the roots.
+    Runs in a worker process.
+    :param task: tuple (list of tuples of moves, board dimensions)
+    :return: dict of canonical key -> result
+    """
+    roots, dimensions = task
+    cells = get_geometry(*dimensions).cells
+    levels = {}
+    for moves in roots:
+        key = Board.from_moves(moves, *dimensions).canonical_key()[0]
+        levels.setdefault(len(moves), {})[key] = moves
+
+    # Enumerate every position that can still be reached
+    first = min(levels)
+    for level in range(first, cells):
+        children = levels.setdefault(level + 1, {})
+        for moves in levels.get(level, {}).values():
+            board = Board.from_moves(moves, *dimensions)
+            for col in board.legal_moves():
+                board.play(col)
+                if board.winner is None and not board.is_full():
+                    children.setdefault(board.canonical_key()[0], board.moves)
+                board.unplay()
+
+    # Solve every level from the results of the next one
+    results = {}
+    for level in range(cells, first - 1, -1):
+        for key, moves in levels.get(level, {}).items():
+            board = Board.from_moves(moves, *dimensions)
+            best = LOSS
+            for col in board.legal_moves():
+                board.play(col)
+                if board.winner is not None:
+                    result = WIN
+                elif board.is_full():
+                    result = DRAW
+                else:
+                    # A loss for the opponent is a win for us and vice versa
+                    result = WIN + LOSS - results[board.canonical_key()[0]]
+                board.unplay()
+                best = max(best, result)
+                if best == WIN:
+                    break
+            results[key] = best
+    return results
+
+
+def generate(roots, max_empty, path, processes=None,
+             width=WIDTH, height=HEIGHT, connect=CONNECT):
+    """
+    Solve all positions with at most max_empty empty cells below the
+    roots and write them to a tablebase file. The work is split over a
+    pool of processes, one group of frontier positions per task.
+    :param roots: iterable of tuples of moves
+    :param max_empty: maximum number of empty cells
+    :param path: file to write
+    :param processes: number of worker processes, default one per core
+    :param width: number of columns
+    :param height: number of rows
+    :param connect: number of chips in a row needed to win
+    :return: number of positions written
+    """
+    start = time.perf_counter()
+    dimensions = (width, height, connect)
+    geometry = get_geometry(*dimensions)
+    frontier = {}
+    for root in roots:
+        frontier.update(_frontier(tuple(root), max_empty, dimensions))
+    logging.info(f'{len(frontier)} frontier positions')
+
+    # Group the frontier, so that subtrees shared within a group are
+    # only solved once
+    groups = (processes or multiprocessing.cpu_count()) * 4
+    frontier = list(frontier.values())
+    tasks = [(frontier[i::groups], dimensions)
+             for i in range(groups) if frontier[i::groups]]
+
+    results = {}
+    with multiprocessing.Pool(processes) as pool:
+        for solved in pool.imap_unordered(_solve, tasks):
+            results.update(solved)
+    logging.info(f'Solved {len(results)} positions in '
+                 f'{time.perf_counter() - start:.1f}s')
+
+    keys = sorted(results)
+    packed = bytearray((len(keys) + 3) // 4)
+    for i, key in enumerate(keys):
+        packed[i >> 2] |= results[key] << ((i & 3) * 2)
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, width, height, connect,
+                            max_empty, len(keys)))
+        for key in keys:
+            f.write(_pack_key(geometry, key))
+        f.write(packed)
+    return len(keys)
+
+
+class _KeyView(object):
+    """Sequence view of the sorted keys in the file, for bisect."""
+    def __init__(self, data, count, key_size):
+        self.__data = data
+        self.__count = count
+        self.__key_size = key_size
+
+    def __len__(self):
+        return self.__count
+
+    def __getitem__(self, i):
+        offset = HEADER.size + i * self.__key_size
+        if self.__key_size == KEY.size:
+            return KEY.unpack_from(self.__data, offset)[0]
+        return int.from_bytes(self.__data[offset:offset + self.__key_size], 'big')
+
+
+class Tablebase(object):
+    """
+    This class probes a tablebase file. The file is memory-mapped, so
+    only the pages that are probed are read from disk, and the file
+    can be shared by several processes. Only boards of the size the
+    file was made for are probed.
+    """
+    def __init__(self, path):
+        self.__file = open(path, 'rb')
+        self.__data = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, width, height, connect, max_empty, count = \
+            HEADER.unpack_from(self.__data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a tablebase file')
+
+        self.geometry = get_geometry(width, height, connect)
+        self.max_empty = max_empty
+        self.__count = count
+        key_size = _key_size(self.geometry)
+        self.__keys = _KeyView(self.__data, count, key_size)
+        self.__results = HEADER.size + count * key_size
+
+    def __len__(self):
+        return self.__count
+
+    def probe(self, board):
+        """
+        Look up the result of a position.
+        :param board: Board to look up
+        :return: WIN, DRAW or LOSS for the player to move, or UNKNOWN
+        """
+        if board.empty_count > self.max_empty or board.geometry is not self.geometry:
+            return UNKNOWN
+        key = board.canonical_key()[0]
+        i = bisect.bisect_left(self.__keys, key)
+        if i == self.__count or self.__keys[i] != key:
+            return UNKNOWN
+        return (self.__data[self.__results + (i >> 2)] >> ((i & 3) * 2)) & 3
+
+    def close(self):
+        """
+        Unmap and close the file.
+        :return: None
+        """
+        self.__data.close()
+        self.__file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Solve late-game positions and write a tablebase file')
+    parser.add_argument('output', help='tablebase file to write')
+    parser.add_argument('--empty', type=int, default=10,
+                        help='solve positions with at most this many empty cells')
+    parser.add_argument('--moves', action='append', required=True,
+                        help='root position as a string of columns; may be repeated. '
+                             'Use an empty string for the empty board, which is only '
+                             'feasible on small boards')
+    parser.add_argument('--processes', type=int, help='number of worker processes')
+    add_dimension_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    roots = [tuple(int(c) for c in moves) for moves in args.moves]
+    generate(roots, args.empty, args.output, args.processes,
+             args.width, args.height, args.connect)
+
+
+if __name__ == '__main__':
+    main()
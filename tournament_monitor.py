@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import logging
+import random
+import threading
+from board_model import Board, CONNECT, HEIGHT, WIDTH, add_dimension_arguments
+from breezypythongui import EasyFrame
+from game_board import GameBoard, board_size, chip_cells
+from load_client import Connection
+
+COLOURS = ['red', 'yellow']
+EMPTY = '#707080'
+
+# Boards are redrawn at most this many times per second
+FRAME_RATE = 30
+
+
+class RenderScheduler(object):
+    """
+    This class redraws the boards of a window once per frame. Feeds
+    {submit} the state of a board as often as they like; only the
+    latest state of every board is kept, and it is drawn at the next
+    frame. Boards that are not visible are skipped, and their latest
+    state is drawn once they are visible again.
+    """
+    def __init__(self, widget, fps=FRAME_RATE):
+        self.__widget = widget
+        self.__delay = max(1, 1000 // fps)
+        self.__lock = threading.Lock()
+
+        # View -> latest state not drawn yet
+        self.__pending = {}
+
+        # Visible views, worked out again when the window changes
+        self.__visible = None
+        for event in ('<Configure>', '<Map>', '<Unmap>'):
+            widget.winfo_toplevel().bind(event, self.__invalidate, add='+')
+
+        # Statistics
+        self.frames = 0
+        self.drawn = 0
+        self.submitted = 0
+
+        widget.after(self.__delay, self.__tick)
+
+    def submit(self, view, state):
+        """
+        Set the state to draw a view in at the next frame, replacing a
+        state that has not been drawn yet. Can be called from any thread.
+        :param view: BoardView to draw
+        :param state: state to pass to the apply method of the view
+        :return: None
+        """
+        with self.__lock:
+            self.__pending[view] = state
+            self.submitted += 1
+
+    def __invalidate(self, _):
+        self.__visible = None
+
+    def __is_visible(self, view):
+        """
+        Check whether a view is on the screen: mapped, and not outside
+        the window.
+        :param view: BoardView
+        :return: True if visible
+        """
+        if self.__visible is None:
+            self.__visible = {}
+        visible = self.__visible.get(view)
+        if visible is None:
+            visible = self.__visible[view] = view.is_visible()
+        return visible
+
+    def __tick(self):
+        """
+        Draw the latest state of every visible view with a new state.
+        :return: None
+        """
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+
+        skipped = {}
+        for view, state in pending.items():
+            if self.__is_visible(view):
+                view.apply(state)
+                self.drawn += 1
+            else:
+                skipped[view] = state
+
+        # Keep skipped states, unless a newer state came in meanwhile
+        if skipped:
+            with self.__lock:
+                skipped.update(self.__pending)
+                self.__pending = skipped
+
+        self.frames += 1
+        self.__widget.after(self.__delay, self.__tick)
+
+
+class BoardView(object):
+    """
+    This class shows a game on a GameBoard. A new state that continues
+    the game on the board only draws the new chips; any other state is
+    drawn by changing the cells that differ.
+    """
+    __slots__ = ('__game_board', '__dimensions', '__title', '__board', '__shown')
+
+    def __init__(self, game_board, dimensions, title=''):
+        self.__game_board = game_board
+        self.__dimensions = dimensions
+        self.__title = title
+        self.__board = Board(*dimensions)
+
+        # Colour of every coloured cell, with row 0 at the top
+        self.__shown = {}
+
+    def is_visible(self):
+        """
+        Check whether the board is on the screen.
+        :return: True if visible
+        """
+        widget = self.__game_board
+        if not widget.winfo_ismapped():
+            return False
+        top = widget.winfo_toplevel()
+        x = widget.winfo_rootx() - top.winfo_rootx()
+        y = widget.winfo_rooty() - top.winfo_rooty()
+        return x < top.winfo_width() and y < top.winfo_height()
+
+    def apply(self, moves):
+        """
+        Show the position after a sequence of moves.
+        :param moves: moves of the game so far
+        :return: None
+        """
+        rows = self.__dimensions[1]
+        board = self.__board
+        if moves[:board.move_count] != board.moves:
+            board = self.__board = Board.from_moves(moves, *self.__dimensions)
+            state = {cell: COLOURS[ply & 1]
+                     for ply, cell in enumerate(chip_cells(moves, *self.__dimensions[:2]))}
+            for cell in self.__shown.keys() | state.keys():
+                colour = state.get(cell, EMPTY)
+                if self.__shown.get(cell, EMPTY) != colour:
+                    self.__game_board.update_cell(*cell, colour)
+            self.__shown = state
+        else:
+            for col in moves[board.move_count:]:
+                colour = COLOURS[board.current_player]
+                cell = (col, rows - 1 - board.play(col))
+                self.__game_board.update_cell(*cell, colour)
+                self.__shown[cell] = colour
+
+        if board.winning_line is not None:
+            self.__game_board.show_line([(c, rows - 1 - r)
+                                         for c, r in board.line_cells(board.winning_line)])
+        else:
+            self.__game_board.hide_line()
+        self.__game_board.set_status(f'{self.__title}  move {board.move_count}')
+
+
+class TournamentMonitor(EasyFrame):
+    """
+    This class shows many games at the same time, on a grid of small
+    boards. All boards share one render scheduler, and boards of the
+    same size share their layout.
+    """
+    def __init__(self, count, columns=8, cell_size=24,
+                 dimensions=(WIDTH, HEIGHT, CONNECT), fps=FRAME_RATE):
+        EasyFrame.__init__(self, title='Connect4 tournament', background='black')
+        self.scheduler = RenderScheduler(self, fps)
+        self.__views = []
+
+        width, height, _ = dimensions
+        for number in range(count):
+            game_board = GameBoard(self, *board_size(width, height, cell_size, extra=0.5),
+                                   columns=width, rows=height, cell_size=cell_size)
+            self.addCanvas(game_board, row=number // columns, column=number % columns)
+            self.__views.append(BoardView(game_board, dimensions, f'Game {number}'))
+
+    def __len__(self):
+        return len(self.__views)
+
+    def update_board(self, number, moves):
+        """
+        Show a new position on a board, at the next frame. Can be
+        called from any thread.
+        :param number: number of the board, from 0
+        :param moves: moves of the game on the board
+        :return: None
+        """
+        self.scheduler.submit(self.__views[number], tuple(moves))
+
+
+async def self_play(monitor, connection, number, depth, random_plies, dimensions):
+    """
+    Let the engine of a game server play games against itself, one
+    after the other, and show them on a board of the monitor. The
+    first moves of every game are random, so that the games differ.
+    :param monitor: TournamentMonitor
+    :param connection: Connection to the game server
+    :param number: number of the board to show the games on
+    :param depth: search depth of the engine
+    :param random_plies: number of random moves at the start of a game
+    :param dimensions: tuple (width, height, connect)
+    :return: None
+    """
+    width, height, connect = dimensions
+    while True:
+        response = await connection.request(op='new', width=width,
+                                            height=height, connect=connect)
+        game = response['game']
+        moves = []
+        over = False
+        while not over:
+            if len(moves) < random_plies:
+                col = random.choice([c for c in range(width) if moves.count(c) < height])
+                response = await connection.request(op='move', game=game, col=col)
+            else:
+                response = await connection.request(op='engine', game=game, depth=depth)
+            moves.append(response['col'])
+            over = response['over']
+            monitor.update_board(number, moves)
+        await connection.request(op='close', game=game)
+
+        # Leave the final position on the board for a moment
+        await asyncio.sleep(2)
+
+
+async def feed(monitor, host, port, depth, random_plies, dimensions):
+    """
+    Play self-play games on all boards of the monitor, over one
+    connection to the game server.
+    :return: None
+    """
+    connection = await Connection.open(host, port)
+    try:
+        await asyncio.gather(*(self_play(monitor, connection, number, depth,
+                                         random_plies, dimensions)
+                               for number in range(len(monitor))))
+    finally:
+        logging.info(f'{monitor.scheduler.submitted} updates, '
+                     f'{monitor.scheduler.drawn} drawn in {monitor.scheduler.frames} frames')
+        await connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch many self-play games at once')
+    parser.add_argument('--boards', type=int, default=16, help='number of boards')
+    parser.add_argument('--columns', type=int, default=8, help='boards per row')
+    parser.add_argument('--cell-size', type=int, default=24, help='size of a cell in pixels')
+    parser.add_argument('--host', default='127.0.0.1', help='game server address')
+    parser.add_argument('--port', type=int, default=4004, help='game server port')
+    parser.add_argument('--depth', type=int, default=4, help='search depth of the engine')
+    parser.add_argument('--random-plies', type=int, default=4,
+                        help='number of random moves at the start of every game')
+    add_dimension_arguments(parser)
+    parser.add_argument('--fps', type=int, default=FRAME_RATE,
+                        help='maximum number of redraws per second')
+    args = parser.parse_args()
+
+    dimensions = (args.width, args.height, args.connect)
+    monitor = TournamentMonitor(args.boards, args.columns, args.cell_size,
+                                dimensions, args.fps)
+    monitor.runAsync(feed(monitor, args.host, args.port, args.depth,
+                          args.random_plies, dimensions))
+
+
+if __name__ == '__main__':
+    main()